@@ -1,26 +1,43 @@
 # app.py
 import streamlit as st
 import os
-from backend.orchestrator_agent import orchestrate
+import uuid
+
+# Thin-client mode: run requests on the headless service (python -m backend.service)
+if os.environ.get("PEACH_SERVICE_URL"):
+    from backend.service_client import orchestrate_remote as orchestrate
+else:
+    from backend.orchestrator_agent import orchestrate
+from backend.upload_store import store_upload
+from backend.version_store import materialize_to_file
+from backend.code_sandbox import enable_copy_on_write
+
+# pandas copy-on-write for the whole app: generated code runs on shallow copies of the
+# sheets, and only the columns it writes are copied (PEACH_COPY_ON_WRITE=0 turns it off)
+enable_copy_on_write()
 
 
 st.set_page_config(page_title="🍑 Peach+", layout="wide")
 st.title("🍑 Peach - Message_ix Chat Agent")
 
+show_trace = st.sidebar.checkbox("⏱️ Show latency breakdown", value=False)
+chain_edits = st.sidebar.checkbox("🔗 Apply edits on top of the previous edit", value=True)
+
 # ---------- FILE UPLOAD ----------
 uploaded_file = st.file_uploader("📤 Upload scenario Excel file", type=["xlsx"])
 
 input_file_path = None
 uploaded = False
+input_key = "base"     # which scenario lineage this session is editing
 
 if uploaded_file:
     uploaded = True
-    os.makedirs("data/history/uploads", exist_ok=True)
     os.makedirs("data/history/outputs", exist_ok=True)
 
-    input_path = os.path.join("data/history/uploads", uploaded_file.name)
-    with open(input_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # content-addressed: unchanged uploads are neither re-hashed nor re-written on reruns
+    if "uploads" not in st.session_state:
+        st.session_state.uploads = {}
+    input_path, input_key, _ = store_upload(uploaded_file, st.session_state.uploads)
     st.success(f"✅ File uploaded: {uploaded_file.name}")
 
 
@@ -28,6 +45,10 @@ if uploaded_file:
 # ---------- CHAT MEMORY ----------
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "user_id" not in st.session_state:
+    st.session_state.user_id = uuid.uuid4().hex[:12]
+if "heads" not in st.session_state:
+    st.session_state.heads = {}          # input_key -> latest scenario version
 
 # Display previous messages
 for msg in st.session_state.messages:
@@ -47,9 +68,13 @@ if user_input:
     with st.chat_message("assistant"):
         with st.spinner("⏳ Processing..."):
             try:
+                kwargs = {"user": st.session_state.user_id} if os.environ.get("PEACH_SERVICE_URL") else {}
                 result = orchestrate(
                     instruction=user_input,
-                    input_file=input_path if uploaded_file else None
+                    input_file=os.path.abspath(input_path) if uploaded_file else None,
+                    input_name=uploaded_file.name if uploaded_file else None,
+                    parent_version_id=st.session_state.heads.get(input_key) if chain_edits else None,
+                    **kwargs
                 )
 
                 # ---------- DISPLAY ----------
@@ -68,15 +93,45 @@ if user_input:
                     with st.expander("📜 Execution Logs"):
                         st.text(result["logs"])
 
-                if result.get("output_file"):
-                    st.download_button(
-                        "⬇️ Download Updated Scenario",
-                        data=open(result["output_file"], "rb"),
-                        file_name=os.path.basename(result["output_file"]),
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                if show_trace and result.get("trace"):
+                    with st.expander("⏱️ Latency breakdown"):
+                        st.dataframe(result["trace"], use_container_width=True)
+                        totals = {}
+                        for row in result["trace"]:
+                            if row["stage"] != "orchestrate":
+                                totals[row["stage"]] = totals.get(row["stage"], 0) + row["duration_ms"]
+                        st.bar_chart(
+                            [{"stage": stage, "duration_ms": ms} for stage, ms in totals.items()],
+                            x="stage", y="duration_ms"
+                        )
+
+                if result.get("version_id"):
+                    st.session_state.heads[input_key] = result["version_id"]
+                    st.session_state.last_output = {
+                        "version_id": result["version_id"],
+                        "output_file": result["output_file"],
+                        "ready": False,
+                    }
 
             except Exception as e:
                 error_message = f"❌ Error: (app.py) {e}"
                 st.error(error_message)
                 st.session_state.messages.append({"role": "assistant", "content": error_message})
+
+
+# ---------- DOWNLOAD ----------
+# versions are stored as deltas; the workbook is only built when requested
+last_output = st.session_state.get("last_output")
+if last_output:
+    if not last_output["ready"] and st.button(f"📦 Prepare `{os.path.basename(last_output['output_file'])}`"):
+        with st.spinner("⏳ Building updated scenario..."):
+            materialize_to_file(last_output["version_id"], last_output["output_file"])
+        last_output["ready"] = True
+    if last_output["ready"]:
+        with open(last_output["output_file"], "rb") as f:
+            st.download_button(
+                "⬇️ Download Updated Scenario",
+                data=f.read(),
+                file_name=os.path.basename(last_output["output_file"]),
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
@@ -0,0 +1,225 @@
+"""
+Batch scenario editing.
+Applies one instruction to many workbooks (e.g. the variants of a scenario):
+    1. every workbook is parsed into the sheet cache in a process pool, and the
+       column schema of its target sheet is hashed;
+    2. the transformation is generated once per distinct schema, with
+       run_scenario_agent on one representative workbook (so LLM calls grow with
+       the number of schemas, not files, and repeat runs hit the code cache);
+    3. the validated code is applied to every workbook in the process pool and the
+       edited workbooks are written in full.
+A JSON manifest lists the outputs, per-file timings and the code used per schema.
+
+Usage:
+    python -m backend.batch_editor "reduce solar inv_cost 10% after 2030" "data/scenarios/*.xlsx"
+        [--sheet inv_cost] [--output-dir data/history/outputs/batch] [--workers 4]
+"""
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from backend.code_cache import schema_hash
+from backend.code_sandbox import enable_copy_on_write, run_candidate
+from backend.sheet_cache import cache_workbook, file_hash, load_sheet
+
+BATCH_OUTPUT_DIR = "data/history/outputs/batch"
+BATCH_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+
+def expand_workbooks(patterns):
+    '''
+    Resolve a list of paths and glob patterns to existing .xlsx files (sorted, deduplicated).
+    '''
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for path in sorted(matches):
+            name = os.path.basename(path)
+            if path.lower().endswith(".xlsx") and not name.startswith("~$") and os.path.isfile(path):
+                if os.path.abspath(path) not in {os.path.abspath(p) for p in paths}:
+                    paths.append(path)
+    return paths
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+# ---------- worker tasks (run in the process pool) ----------
+
+def prepare_workbook(path, sheet_name):
+    '''
+    Parse a workbook into the sheet cache and hash the schema of its target sheet.
+    Output: dict with path, content_hash, sheets, schema (None if the sheet is missing), parse_ms
+    '''
+    start = time.perf_counter()
+    content_hash = file_hash(path)
+    sheets = cache_workbook(path, content_hash)
+    schema = None
+    if sheet_name in sheets:
+        schema = schema_hash(load_sheet(path, sheet_name, content_hash))
+    return {"path": path, "content_hash": content_hash, "sheets": sheets, "schema": schema,
+            "parse_ms": _elapsed_ms(start)}
+
+
+def apply_to_workbook(path, content_hash, sheet_name, code, instruction, output_file):
+    '''
+    Run validated code on the target sheet of one workbook and write the edited workbook.
+    Output: dict with status, output, error and timings (load_ms, exec_ms, write_ms)
+    '''
+    timings = {}
+    try:
+        start = time.perf_counter()
+        df_input = load_sheet(path, sheet_name, content_hash)
+        timings["load_ms"] = _elapsed_ms(start)
+
+        start = time.perf_counter()
+        _, df_new, _ = run_candidate(code, df_input, instruction)
+        timings["exec_ms"] = _elapsed_ms(start)
+
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        with pd.ExcelWriter(output_file) as writer:
+            for name in cache_workbook(path, content_hash):
+                df = df_new if name == sheet_name else load_sheet(path, name, content_hash)
+                df.to_excel(writer, sheet_name=name[:31], index=False)
+        timings["write_ms"] = _elapsed_ms(start)
+        return {"status": "ok", "output": output_file, "timings": timings}
+    except Exception as e:
+        return {"status": "failed", "output": None, "error": f"{type(e).__name__}: {e}", "timings": timings}
+
+
+# ---------- batch run ----------
+
+def select_sheet(instruction, path):
+    '''Pick the target sheet of a workbook for an instruction (same selection as an uploaded file).'''
+    from backend.scenario_editor import read_uploaded_file_data
+    _, sheet_name = read_uploaded_file_data(path, instruction)
+    return sheet_name
+
+
+def generate_for_schema(instruction, path, content_hash, sheet_name):
+    '''
+    Generate and validate the transformation for one schema on a representative workbook.
+    Output: dict with success, code, logs, codegen_ms
+    '''
+    from backend.scenario_editor import run_scenario_agent
+
+    start = time.perf_counter()
+    df_input = load_sheet(path, sheet_name, content_hash)
+    result = run_scenario_agent(instruction, path, uploaded=True, target=(df_input, sheet_name, []))
+    return {"success": result["success"], "code": result.get("code"), "logs": result.get("logs"),
+            "codegen_ms": _elapsed_ms(start)}
+
+
+def run_batch(instruction, workbooks, sheet_name=None, output_dir=BATCH_OUTPUT_DIR, workers=BATCH_WORKERS):
+    '''
+    Apply one instruction to many workbooks.
+    Inputs:
+        - instruction (str): edit instruction, e.g. "reduce solar inv_cost 10% after 2030"
+        - workbooks (list of str): paths and/or glob patterns of .xlsx files
+        - sheet_name (str, optional): target sheet; selected from the first workbook if omitted
+        - output_dir (str): where edited workbooks and the manifest are written
+        - workers (int): process pool size
+    Output: manifest (dict), also written to <output_dir>/manifest-<timestamp>.json
+    '''
+    started = time.perf_counter()
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    paths = expand_workbooks(workbooks)
+    if not paths:
+        raise ValueError(f"❌ No .xlsx workbooks match {workbooks}.")
+    workers = max(1, min(workers, len(paths)))
+    print(f"📚 Batch edit over {len(paths)} workbooks with {workers} workers")
+
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=enable_copy_on_write) as pool:
+        # 1. target sheet, then parse + schema hash of every workbook
+        if sheet_name is None:
+            sheet_name = select_sheet(instruction, paths[0])
+            print(f"🔍 Identified target sheet: '{sheet_name}'")
+        prepared = list(pool.map(prepare_workbook, paths, [sheet_name] * len(paths)))
+
+        # 2. one generation per distinct schema
+        schemas = {}
+        for info in prepared:
+            if info["schema"] is not None:
+                schemas.setdefault(info["schema"], []).append(info)
+        generated = {}
+        for schema, infos in schemas.items():
+            rep = infos[0]
+            print(f"🧠 Generating code for schema {schema} ({len(infos)} workbooks) on {Path(rep['path']).name}")
+            generated[schema] = generate_for_schema(instruction, rep["path"], rep["content_hash"], sheet_name)
+
+        # 3. apply in parallel
+        futures = {}
+        for info in prepared:
+            gen = generated.get(info["schema"])
+            if gen and gen["success"]:
+                output_file = os.path.join(output_dir, f"{Path(info['path']).stem}-updated-{timestamp}.xlsx")
+                futures[info["path"]] = pool.submit(apply_to_workbook, info["path"], info["content_hash"],
+                                                    sheet_name, gen["code"], instruction, output_file)
+
+        files = []
+        for info in prepared:
+            entry = {"input": info["path"], "sheet": sheet_name, "schema": info["schema"],
+                     "timings": {"parse_ms": info["parse_ms"]}}
+            if info["schema"] is None:
+                entry.update(status="skipped", output=None, error=f"No sheet named '{sheet_name}'")
+            elif info["path"] not in futures:
+                entry.update(status="failed", output=None, error="Code generation failed for this schema")
+            else:
+                result = futures[info["path"]].result()
+                entry.update(status=result["status"], output=result["output"])
+                entry["timings"].update(result["timings"])
+                if result.get("error"):
+                    entry["error"] = result["error"]
+            files.append(entry)
+
+    manifest = {
+        "instruction": instruction,
+        "created": datetime.now().isoformat(),
+        "sheet": sheet_name,
+        "workers": workers,
+        "wall_ms": _elapsed_ms(started),
+        "succeeded": sum(f["status"] == "ok" for f in files),
+        "files": files,
+        "schemas": [{"schema": schema, "representative": schemas[schema][0]["path"], "workbooks": len(schemas[schema]),
+                     "success": gen["success"], "codegen_ms": gen["codegen_ms"], "code": gen["code"]}
+                    for schema, gen in generated.items()],
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, f"manifest-{timestamp}.json")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    manifest["manifest"] = manifest_path
+    print(f"✅ {manifest['succeeded']}/{len(files)} workbooks edited in {manifest['wall_ms'] / 1000:.1f} s "
+          f"({len(generated)} code generations) — manifest: {manifest_path}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply one scenario-editing instruction to many workbooks.")
+    parser.add_argument("instruction", help="edit instruction")
+    parser.add_argument("workbooks", nargs="+", help="workbook paths or glob patterns")
+    parser.add_argument("--sheet", help="target sheet (default: selected from the first workbook)")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    args = parser.parse_args()
+
+    enable_copy_on_write()
+    manifest = run_batch(args.instruction, args.workbooks, args.sheet, args.output_dir, args.workers)
+    for f in manifest["files"]:
+        if f["status"] != "ok":
+            print(f"  ⚠️ {f['input']}: {f['status']} — {f.get('error')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Cache of validated, successfully executed scenario-editor code.
+Entries are keyed on (target sheet, column schema hash, normalized instruction)
+and stored in the `code_cache` table of the conversation history database.
+Numbers in the instruction become parameter slots, so "increase by 10%" and
+"increase by 20%" share one entry: the numeric literals derived from them in the
+code (10, 0.1, 1.1, 0.9) are stored as slots and re-rendered on a hit. A hit
+skips the LLM and goes straight to validation and execution.
+
+    python -m backend.code_cache --since 7d     # hit rate and saved LLM latency
+"""
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+from datetime import datetime
+
+from backend import conv_history
+from backend.tracing import parse_time
+
+NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?!\w|\.\d)")
+SLOT = re.compile(r"<<n(\d+)\|(raw|frac|up|down)>>")
+
+# how an instruction number can show up in the generated code
+SLOT_FORMS = {
+    "raw": lambda v: v,
+    "frac": lambda v: v / 100,
+    "up": lambda v: 1 + v / 100,
+    "down": lambda v: 1 - v / 100,
+}
+
+
+def init_code_cache_table():
+    '''
+    Create the code_cache and code_cache_events tables if they don't exist.
+    Output: None
+    '''
+    try:
+        with sqlite3.connect(conv_history.DB_PATH) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS code_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    sheet_name TEXT NOT NULL,
+                    schema_hash TEXT NOT NULL,
+                    instruction_key TEXT NOT NULL,
+                    template TEXT NOT NULL,
+                    parameterized INTEGER,
+                    llm_ms REAL,
+                    hits INTEGER DEFAULT 0,
+                    created TEXT,
+                    last_used TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS code_cache_events (
+                    timestamp TEXT,
+                    event TEXT,
+                    cache_key TEXT,
+                    saved_ms REAL
+                )
+            """)
+    except Exception as e:
+        print("❌ Error initializing code cache tables:", e)
+
+
+# ---------- keys ----------
+
+def schema_hash(df):
+    '''
+    Hash of a sheet's column names and dtype kinds (int/float/object...), in order.
+    Input: df (pd.DataFrame)
+    Output: hex digest (str)
+    '''
+    schema = [(str(col), df[col].dtype.kind) for col in df.columns]
+    return hashlib.sha256(json.dumps(schema).encode()).hexdigest()[:16]
+
+
+def normalize_instruction(instruction):
+    '''
+    Lowercase, collapse whitespace and replace every number with a slot.
+    Input: instruction (str)
+    Outputs:
+        - normalized instruction (str), e.g. "increase coal costs by <n0>%"
+        - numbers (list of str), in order of appearance
+    '''
+    text = " ".join(instruction.lower().split()).rstrip(" .!?")
+    numbers = NUMBER.findall(text)
+    counter = iter(range(len(numbers)))
+    return NUMBER.sub(lambda m: f"<n{next(counter)}>", text), numbers
+
+
+def cache_key(sheet_name, schema, instruction_key):
+    return hashlib.sha256(f"{sheet_name}\x00{schema}\x00{instruction_key}".encode()).hexdigest()
+
+
+# ---------- templates ----------
+
+def format_number(value):
+    '''Render a slot value as a Python literal (ints stay ints).'''
+    value = round(value, 10)
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def make_template(code, numbers):
+    '''
+    Replace the numeric literals in code that come from instruction numbers with slots.
+    A literal becomes a slot only if it matches exactly one form of one number, and
+    every number is matched by exactly one literal; 0 and 1 are never slots.
+    Inputs:
+        - code (str): validated code
+        - numbers (list of str): numbers of the instruction
+    Output: template (str), or None if a number cannot be located in the code
+            unambiguously (the entry is then cached for the exact instruction only)
+    '''
+    values = [float(n) for n in numbers]
+    if len(set(values)) != len(values):
+        return None
+
+    slots = {}          # literal position -> (number index, form)
+    for match in NUMBER.finditer(code):
+        literal = float(match.group(0))
+        if literal in (0, 1):
+            continue
+        candidates = [(i, form) for i, v in enumerate(values)
+                      for form, fn in SLOT_FORMS.items() if abs(fn(v) - literal) < 1e-9]
+        if len(candidates) > 1:
+            return None
+        if candidates:
+            slots[match.start()] = candidates[0]
+
+    matched = [i for i, _ in slots.values()]
+    if sorted(matched) != list(range(len(values))):
+        return None
+
+    def replace(match):
+        if match.start() not in slots:
+            return match.group(0)
+        i, form = slots[match.start()]
+        return f"<<n{i}|{form}>>"
+
+    return NUMBER.sub(replace, code)
+
+
+def render_template(template, numbers):
+    '''Fill a template's slots with the numbers of the current instruction.'''
+    values = [float(n) for n in numbers]
+    return SLOT.sub(lambda m: format_number(SLOT_FORMS[m.group(2)](values[int(m.group(1))])), template)
+
+
+# ---------- lookup / store ----------
+
+def _keys(df, instruction):
+    normalized, numbers = normalize_instruction(instruction)
+    literal = " ".join(instruction.lower().split()).rstrip(" .!?")
+    return schema_hash(df), normalized, literal, numbers
+
+
+def _log_event(conn, event, key, saved_ms=None):
+    conn.execute(
+        "INSERT INTO code_cache_events (timestamp, event, cache_key, saved_ms) VALUES (?, ?, ?, ?)",
+        (datetime.now().isoformat(), event, key, saved_ms)
+    )
+
+
+def lookup(sheet_name, df, instruction):
+    '''
+    Find cached code for an instruction on a sheet with this schema.
+    Inputs:
+        - sheet_name (str), df (pd.DataFrame): target sheet
+        - instruction (str): user's instruction
+    Output: dict with keys cache_key, code, llm_ms, or None on a miss
+    '''
+    schema, normalized, literal, numbers = _keys(df, instruction)
+    try:
+        with sqlite3.connect(conv_history.DB_PATH) as conn:
+            for instruction_key in (normalized, literal):
+                key = cache_key(sheet_name, schema, instruction_key)
+                row = conn.execute(
+                    "SELECT template, parameterized, llm_ms FROM code_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    continue
+                template, parameterized, llm_ms = row
+                code = render_template(template, numbers) if parameterized else template
+                conn.execute(
+                    "UPDATE code_cache SET hits = hits + 1, last_used = ? WHERE cache_key = ?",
+                    (datetime.now().isoformat(), key)
+                )
+                _log_event(conn, "hit", key, llm_ms)
+                return {"cache_key": key, "code": code, "llm_ms": llm_ms}
+            _log_event(conn, "miss", cache_key(sheet_name, schema, normalized))
+    except Exception as e:
+        print("❌ Code cache lookup failed:", e)
+    return None
+
+
+def store(sheet_name, df, instruction, code, llm_ms):
+    '''
+    Cache code that passed validation and executed successfully.
+    Inputs:
+        - sheet_name (str), df (pd.DataFrame): target sheet (before the edit)
+        - instruction (str): user's instruction
+        - code (str): the executed code
+        - llm_ms (float): LLM time spent producing it (what a future hit saves)
+    Output: None
+    '''
+    schema, normalized, literal, numbers = _keys(df, instruction)
+    template = make_template(code, numbers) if numbers else code
+    parameterized = bool(numbers) and template is not None
+    if template is None:
+        template = code
+    instruction_key = normalized if parameterized or not numbers else literal
+    key = cache_key(sheet_name, schema, instruction_key)
+    now = datetime.now().isoformat()
+    try:
+        with sqlite3.connect(conv_history.DB_PATH) as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO code_cache
+                (cache_key, sheet_name, schema_hash, instruction_key, template, parameterized, llm_ms, hits, created, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+            """, (key, sheet_name, schema, instruction_key, template, int(parameterized), llm_ms, now, now))
+            _log_event(conn, "store", key)
+    except Exception as e:
+        print("❌ Code cache store failed:", e)
+
+
+def invalidate(key):
+    '''Drop an entry whose code failed to execute on a hit.'''
+    try:
+        with sqlite3.connect(conv_history.DB_PATH) as conn:
+            conn.execute("DELETE FROM code_cache WHERE cache_key = ?", (key,))
+            _log_event(conn, "invalidate", key)
+    except Exception as e:
+        print("❌ Code cache invalidate failed:", e)
+
+
+# ---------- reporting ----------
+
+def cache_stats(since=None, until=None):
+    '''
+    Hit rate and saved LLM latency over a time range.
+    Inputs: since / until (datetime or epoch seconds, optional)
+    Output: dict with lookups, hits, misses, hit_rate, saved_ms, stores, invalidations, entries
+    '''
+    where, params = [], []
+    for op, bound in ((">=", since), ("<=", until)):
+        if bound is None:
+            continue
+        if isinstance(bound, (int, float)):
+            bound = datetime.fromtimestamp(bound)
+        where.append(f"timestamp {op} ?")
+        params.append(bound.isoformat())
+    clause = f"WHERE {' AND '.join(where)}" if where else ""
+
+    with sqlite3.connect(conv_history.DB_PATH) as conn:
+        counts = dict(conn.execute(
+            f"SELECT event, COUNT(*) FROM code_cache_events {clause} GROUP BY event", params
+        ).fetchall())
+        saved = conn.execute(
+            f"SELECT COALESCE(SUM(saved_ms), 0) FROM code_cache_events {clause} {'AND' if clause else 'WHERE'} event = 'hit'",
+            params
+        ).fetchone()[0]
+        entries = conn.execute("SELECT COUNT(*), COALESCE(SUM(parameterized), 0) FROM code_cache").fetchone()
+
+    hits, misses = counts.get("hit", 0), counts.get("miss", 0)
+    lookups = hits + misses
+    return {
+        "lookups": lookups,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else None,
+        "saved_ms": saved,
+        "stores": counts.get("store", 0),
+        "invalidations": counts.get("invalidate", 0),
+        "entries": entries[0],
+        "parameterized_entries": entries[1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Code-generation cache hit rate and saved LLM latency.")
+    parser.add_argument("--since", help="ISO date/time or relative duration (e.g. 24h, 7d)")
+    parser.add_argument("--until", help="ISO date/time or relative duration")
+    args = parser.parse_args()
+
+    init_code_cache_table()
+    s = cache_stats(parse_time(args.since), parse_time(args.until))
+    hit_rate = f"{s['hit_rate'] * 100:.1f}%" if s["hit_rate"] is not None else "-"
+    print(f"lookups: {s['lookups']}  hits: {s['hits']}  misses: {s['misses']}  hit rate: {hit_rate}")
+    print(f"saved LLM latency: {s['saved_ms'] / 1000:.1f} s")
+    print(f"entries: {s['entries']} ({s['parameterized_entries']} parameterized)  "
+          f"stored: {s['stores']}  invalidated: {s['invalidations']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Validation and execution of model-generated pandas code.
+Used by the scenario editor for every candidate program: the safety checks run
+on each candidate (not only the first), and a candidate only passes if it
+executes and its result keeps the invariants of the target sheet.
+"""
+import os
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from backend.tracing import span
+
+# Copy-on-write: each execution gets a shallow copy of the target sheet and only the
+# columns the code writes are copied. It is a process-wide pandas mode, so entry points
+# turn it on at startup with enable_copy_on_write(); execute_code follows whatever mode
+# the process runs in.
+COPY_ON_WRITE = os.environ.get("PEACH_COPY_ON_WRITE", "1") != "0"
+
+forbidden_patterns = [
+    r"os\.", r"sys\.", r"open\s*\(", r"subprocess",
+    r"eval\s*\(", r"exec\s*\(", r"__", r"shutil", r"pathlib"
+]
+allowed_import_packages = ["numpy", "pandas"]
+drop_terms = ["drop", "remove", "delete", "exclude", "filter out", "only keep", "keep only"]
+
+
+def enable_copy_on_write():
+    '''
+    Turn on pandas copy-on-write for this process, unless PEACH_COPY_ON_WRITE=0. Chained
+    assignment (df[col][mask] = ...), which does nothing under copy-on-write, becomes an
+    error, so a generated program relying on it fails and is retried.
+    '''
+    if COPY_ON_WRITE:
+        pd.set_option("mode.copy_on_write", True)
+        warnings.filterwarnings("error", category=pd.errors.ChainedAssignmentError)
+
+
+def clean_code(response):
+    '''Strip markdown fences from a model response.'''
+    return re.sub(r"^```(?:python)?|```$", "", response.strip(), flags=re.MULTILINE).strip()
+
+
+def validate_code(code):
+    '''
+    Safety checks on generated code; auto-adds the pandas/numpy imports if missing.
+    Input: code (str)
+    Outputs:
+        - code (str): code ready to execute
+        - notes (list of str): log lines about what was added
+    Raises ValueError if the code is unsafe.
+    '''
+    if any(re.search(p, code, re.IGNORECASE) for p in forbidden_patterns):
+        raise ValueError("⚠️ Unsafe code detected! Execution blocked.")
+
+    import_lines = re.findall(r"^\s*(?:import|from)\s+[^\n]+", code, flags=re.MULTILINE)
+    for line in import_lines:
+        if not any(pkg in line for pkg in allowed_import_packages):
+            raise ValueError(f"⚠️ Unsafe import detected: '{line.strip()}' — only numpy and pandas are allowed.")
+
+    notes = []
+    if "import pandas" not in code:
+        notes.append("ℹ️ Auto-added: import pandas as pd")
+        code = "import pandas as pd\n" + code
+    if "import numpy" not in code:
+        notes.append("ℹ️ Auto-added: import numpy as np")
+        code = "import numpy as np\n" + code
+    return code, notes
+
+
+def check_invariants(df_input, df_new, instruction):
+    '''
+    Raise ValueError if the edited sheet breaks the invariants of the input sheet:
+    a DataFrame is produced, and rows/columns disappear only if the instruction asks for it.
+    '''
+    if not isinstance(df_new, pd.DataFrame):
+        raise ValueError("No valid DataFrame 'df' produced.")
+    if any(term in instruction.lower() for term in drop_terms):
+        return
+    missing = [c for c in df_input.columns if c not in df_new.columns]
+    if missing:
+        raise ValueError(f"Columns were dropped but the instruction doesn't ask for it: {missing}")
+    if len(df_input) and df_new.empty:
+        raise ValueError("All rows were dropped but the instruction doesn't ask for it.")
+
+
+def execute_code(code, df_input, instruction):
+    '''
+    Run validated code against a copy of the target sheet.
+    Inputs:
+        - code (str): output of validate_code
+        - df_input (pd.DataFrame): target sheet (left untouched)
+        - instruction (str): user's instruction, for the invariant checks
+    Output: df_new (pd.DataFrame). Raises on execution errors or broken invariants.
+    '''
+    def run(df):
+        # float32 columns of typed sheets are edited at full precision
+        narrow = {c: np.float64 for c in df.columns if df[c].dtype == np.float32}
+        local_env = {"df": df.astype(narrow) if narrow else df, "pd": pd, "np": np}
+        exec(code, {}, local_env)
+        return local_env.get("df")
+
+    copy_on_write = pd.get_option("mode.copy_on_write") is True
+    try:
+        df_new = run(df_input.copy(deep=not copy_on_write))
+    except (TypeError, ValueError) as e:
+        # typed sheets: writing a value that is not an existing category fails; rerun on plain text columns
+        categorical = [c for c in df_input.columns if isinstance(df_input[c].dtype, pd.CategoricalDtype)]
+        if not categorical or "categor" not in str(e).lower():
+            raise
+        df_new = run(df_input.astype({c: object for c in categorical}))
+    check_invariants(df_input, df_new, instruction)
+    return df_new
+
+
+def run_candidate(code, df_input, instruction, candidate=0):
+    '''
+    Validate and execute one candidate program.
+    Output: (code, df_new, notes); raises on any failure.
+    '''
+    code, notes = validate_code(code)
+    with span("code_exec", candidate=candidate):
+        df_new = execute_code(code, df_input, instruction)
+    return code, df_new, notes
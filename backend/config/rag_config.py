@@ -7,6 +7,11 @@ INDEX_PATH = "rag_store/faiss_hnsw_index.faiss"
 META_PATH = "rag_store/rag_metadata.parquet"
 EMBEDDING_MODEL = "intfloat/e5-small-v2"
 
+# --- context assembly ---
+RAG_TOP_K = 5
+CONTEXT_TOKEN_BUDGET = 1200      # approximate tokens of retrieved context sent to the generator
+DEDUP_THRESHOLD = 0.8            # shingle Jaccard similarity treated as a duplicate chunk
+
 @st.cache_resource(show_spinner=False)
 def load_rag_resources():
     """
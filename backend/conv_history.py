@@ -1,10 +1,33 @@
 import sqlite3, time
+import argparse
+import hashlib
+import os
+import statistics
 import uuid
+import zlib
+from datetime import datetime, timezone, timedelta
 from pathlib import Path
 
+try:
+    import zstandard
+except ImportError:         # optional: payloads fall back to zlib
+    zstandard = None
+
 BASE_DIR = Path(r"D:\lums-python-programming\thesis\project")
 DB_PATH = BASE_DIR / "data" / "history" / "conv_history.db"
 
+# --- payload storage ---
+# responses, generated code and logs longer than INLINE_LIMIT characters are stored
+# once per distinct content in the `payloads` table, compressed, and referenced by hash
+INLINE_LIMIT = 512
+PAYLOAD_CODEC = "zstd" if zstandard else "zlib"
+CODE_MARKER = "\n\nGenerated code:\n"
+
+# --- retention / compaction ---
+RETENTION_DAYS = int(os.environ["PEACH_HISTORY_RETENTION_DAYS"]) if os.environ.get("PEACH_HISTORY_RETENTION_DAYS") else None
+COMPACT_BATCH = 500
+PKT = timezone(timedelta(hours=5))
+
 # --- Initialize database once ---
 def init_db():
     '''
@@ -13,6 +36,8 @@ def init_db():
     '''
     try:
         with sqlite3.connect(DB_PATH) as conn:
+            # new databases give deleted pages back incrementally (see compact)
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS conversation_history (
                     conv_id TEXT,
@@ -22,7 +47,24 @@ def init_db():
                     query TEXT NOT NULL,
                     response TEXT,
                     output_file_name TEXT,
-                    timestamp TEXT
+                    timestamp TEXT,
+                    version_id TEXT,
+                    parent_version_id TEXT
+                )
+            """)
+            # older databases: add the scenario version columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(conversation_history)")}
+            for column in ("version_id", "parent_version_id", "response_ref", "code_ref", "logs_ref"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE conversation_history ADD COLUMN {column} TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_conv ON conversation_history (conv_id, turn_id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS payloads (
+                    hash TEXT PRIMARY KEY,
+                    codec TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    raw_size INTEGER,
+                    stored_size INTEGER
                 )
             """)
         print("✅ Conversation history database initialized.")
@@ -30,7 +72,65 @@ def init_db():
         print("❌ Error initializing database:", e)
 
 
-def log_turn(conv_id, mode, routing_reason, timestamp, query, response, output_file_name=None):
+# ---------- compressed payloads ----------
+
+def compress_payload(text):
+    '''
+    Compress a text payload with zstd when available, else zlib.
+    Output: (codec, blob)
+    '''
+    raw = text.encode("utf-8")
+    if PAYLOAD_CODEC == "zstd":
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(raw)
+    return "zlib", zlib.compress(raw, 9)
+
+
+def decompress_payload(codec, blob):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("❌ Payload is zstd-compressed but the 'zstandard' package is not installed.")
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    if codec == "zlib":
+        return zlib.decompress(blob).decode("utf-8")
+    return blob.decode("utf-8")
+
+
+def store_payload(conn, text, inline=True):
+    '''
+    Store a text payload once per distinct content.
+    Inputs: conn (sqlite3.Connection), text (str or None),
+            inline (bool): keep texts up to INLINE_LIMIT characters inline
+    Outputs: (inline text, payload hash) — the text stays inline if it is short, else it is
+             stored in the payloads table and only its hash is kept
+    '''
+    if text is None or (inline and len(text) <= INLINE_LIMIT):
+        return text, None
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    if conn.execute("SELECT 1 FROM payloads WHERE hash = ?", (digest,)).fetchone() is None:
+        codec, blob = compress_payload(text)
+        conn.execute(
+            "INSERT OR IGNORE INTO payloads (hash, codec, data, raw_size, stored_size) VALUES (?, ?, ?, ?, ?)",
+            (digest, codec, blob, len(text.encode("utf-8")), len(blob))
+        )
+    return None, digest
+
+
+def load_payloads(conn, hashes):
+    '''
+    Decompress payloads by hash in one query.
+    Output: dict hash -> text
+    '''
+    hashes = sorted({h for h in hashes if h})
+    if not hashes:
+        return {}
+    rows = conn.execute(
+        f"SELECT hash, codec, data FROM payloads WHERE hash IN ({','.join('?' * len(hashes))})", hashes
+    ).fetchall()
+    return {h: decompress_payload(codec, data) for h, codec, data in rows}
+
+
+def log_turn(conv_id, mode, routing_reason, timestamp, query, response, output_file_name=None,
+             version_id=None, parent_version_id=None, code=None, logs=None):
     ''' 
     Log a single turn in the conversation history.
     Inputs:
@@ -40,6 +140,10 @@ def log_turn(conv_id, mode, routing_reason, timestamp, query, response, output_f
     - query (str): User's question or instruction
     - response (str): Assistant's response
     - output_file_name (str, optional): For Excel mode, the name of the output file
+    - version_id (str, optional): For Excel mode, the scenario version created by this turn
+    - parent_version_id (str, optional): The version the edit was applied to (None = base workbook)
+    - code (str, optional): For Excel mode, the generated code
+    - logs (str, optional): Execution logs
     - timestamp (str): ISO formatted timestamp
     Output: None
 
@@ -48,11 +152,18 @@ def log_turn(conv_id, mode, routing_reason, timestamp, query, response, output_f
     for attempt in range(5):
         try:
             with sqlite3.connect(DB_PATH, timeout=10) as conn:
+                # large payloads go to the compressed payloads table; code always does,
+                # since the same code is often regenerated and is deduplicated there
+                response, response_ref = store_payload(conn, response)
+                code_ref = store_payload(conn, code, inline=False)[1] if code else None
+                logs_ref = store_payload(conn, logs, inline=False)[1] if logs else None
                 conn.execute("""
                     INSERT INTO conversation_history
-                    (conv_id, mode, routing_reason, query, response, output_file_name, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (conv_id, mode, routing_reason, query, response, output_file_name, timestamp))
+                    (conv_id, mode, routing_reason, query, response, output_file_name, timestamp,
+                     version_id, parent_version_id, response_ref, code_ref, logs_ref)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (conv_id, mode, routing_reason, query, response, output_file_name, timestamp,
+                      version_id, parent_version_id, response_ref, code_ref, logs_ref))
                 conn.commit()
             break  
         except sqlite3.OperationalError as e:
@@ -71,15 +182,26 @@ def get_conversation(conv_id):
     Retrieve chat history for a given conversation ID.
     Input: conv_id (str)
     Output: List of tuples (turn_id, mode, routing_reason, query, response, output_file_name, timestamp)
+    (for Excel mode the response ends with the generated code, as it was logged)
     '''
     with sqlite3.connect(DB_PATH) as conn:
         rows = conn.execute("""
-            SELECT turn_id, mode, routing_reason, query, response, output_file_name, timestamp
+            SELECT turn_id, mode, routing_reason, query, response, output_file_name, timestamp,
+                   response_ref, code_ref
             FROM conversation_history
             WHERE conv_id = ?
            -- ORDER BY turn_id ASC
         """, (conv_id,)).fetchall()
-    return rows
+        payloads = load_payloads(conn, [h for row in rows for h in row[7:]])
+
+    turns = []
+    for turn_id, mode, routing_reason, query, response, output_file_name, timestamp, response_ref, code_ref in rows:
+        if response_ref:
+            response = payloads.get(response_ref)
+        if code_ref:
+            response = f"{response}{CODE_MARKER}{payloads.get(code_ref)}"
+        turns.append((turn_id, mode, routing_reason, query, response, output_file_name, timestamp))
+    return turns
 
 
 def new_conversation():
@@ -89,3 +211,211 @@ def new_conversation():
     '''
     conv_id = str(uuid.uuid4())[:13]  # 
     return conv_id
+
+
+# ---------- compaction / retention ----------
+
+def compact(retention_days=RETENTION_DAYS, batch_size=COMPACT_BATCH, max_batches=None, vacuum=False):
+    '''
+    Incremental compaction job; each batch is its own short transaction, so it can run
+    next to the app and be stopped at any time.
+        1. deletes turns, trace spans and code-cache events older than retention_days
+           (None = keep everything)
+        2. moves large inline payloads of rows logged before payload storage existed
+           (and the code inside their scenario replies) to the payloads table
+        3. drops payloads no turn references anymore and returns free pages to the OS
+    Inputs:
+        - retention_days (int, optional): age limit of turns, trace spans and cache events
+        - batch_size (int): rows per transaction
+        - max_batches (int, optional): stop after this many batches per step
+        - vacuum (bool): run a full VACUUM at the end (also enables incremental vacuum on old databases)
+    Output: dict with migrated, expired, spans_expired, cache_events_expired, payloads_removed
+    '''
+    stats = {"migrated": 0, "expired": 0, "spans_expired": 0, "cache_events_expired": 0, "payloads_removed": 0}
+
+    def batches():
+        n = 0
+        while max_batches is None or n < max_batches:
+            n += 1
+            yield n
+
+    def expire(conn, table, column, cutoff, stat):
+        # trace_spans / code_cache_events only exist once tracing / the code cache ran
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            return
+        for _ in batches():
+            cur = conn.execute(f"""
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table} WHERE {column} < ? LIMIT ?
+                )
+            """, (cutoff, batch_size))
+            conn.commit()
+            stats[stat] += cur.rowcount
+            if cur.rowcount < batch_size:
+                break
+
+    with sqlite3.connect(DB_PATH, timeout=10) as conn:
+        if retention_days is not None:
+            # each table keeps its own timestamp format: PKT string, epoch seconds, local ISO
+            cutoff = datetime.now(PKT) - timedelta(days=retention_days)
+            expire(conn, "conversation_history", "timestamp", cutoff.strftime("%Y%m%d-%H%M%S"), "expired")
+            expire(conn, "trace_spans", "start_ts", cutoff.timestamp(), "spans_expired")
+            expire(conn, "code_cache_events", "timestamp",
+                   (datetime.now() - timedelta(days=retention_days)).isoformat(), "cache_events_expired")
+
+        for _ in batches():
+            rows = conn.execute("""
+                SELECT turn_id, response FROM conversation_history
+                WHERE response_ref IS NULL AND code_ref IS NULL
+                  AND (length(response) > ? OR instr(response, ?) > 0)
+                LIMIT ?
+            """, (INLINE_LIMIT, CODE_MARKER, batch_size)).fetchall()
+            if not rows:
+                break
+            for turn_id, response in rows:
+                reply, _, code = response.partition(CODE_MARKER)
+                code = code if code and code != "None" else None
+                reply, response_ref = store_payload(conn, reply)
+                code_ref = store_payload(conn, code, inline=False)[1] if code else None
+                conn.execute(
+                    "UPDATE conversation_history SET response = ?, response_ref = ?, code_ref = ? WHERE turn_id = ?",
+                    (reply, response_ref, code_ref, turn_id)
+                )
+            conn.commit()
+            stats["migrated"] += len(rows)
+
+        for _ in batches():
+            cur = conn.execute("""
+                DELETE FROM payloads WHERE hash IN (
+                    SELECT hash FROM payloads WHERE hash NOT IN (
+                        SELECT response_ref FROM conversation_history WHERE response_ref IS NOT NULL
+                        UNION SELECT code_ref FROM conversation_history WHERE code_ref IS NOT NULL
+                        UNION SELECT logs_ref FROM conversation_history WHERE logs_ref IS NOT NULL
+                    ) LIMIT ?
+                )
+            """, (batch_size,))
+            conn.commit()
+            stats["payloads_removed"] += cur.rowcount
+            if cur.rowcount < batch_size:
+                break
+
+        conn.execute("PRAGMA incremental_vacuum")
+    if vacuum:
+        with sqlite3.connect(DB_PATH, timeout=10) as conn:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+    return stats
+
+
+# ---------- export / report ----------
+
+def export_parquet(output_path, since=None):
+    '''
+    Export conversation turns, with payloads decompressed, to a Parquet file for analysis.
+    Inputs:
+        - output_path (str): target .parquet file
+        - since (str, optional): only turns with timestamp >= since ("%Y%m%d-%H%M%S")
+    Output: number of exported turns
+    '''
+    import pandas as pd
+
+    with sqlite3.connect(DB_PATH) as conn:
+        df = pd.read_sql_query(
+            "SELECT * FROM conversation_history WHERE (? IS NULL OR timestamp >= ?) ORDER BY turn_id",
+            conn, params=(since, since)
+        )
+        payloads = load_payloads(conn, pd.concat([df["response_ref"], df["code_ref"], df["logs_ref"]]).dropna())
+
+    inline = df["response"].fillna("").str.partition(CODE_MARKER)
+    df["response"] = df["response_ref"].map(payloads).fillna(inline[0].where(df["response"].notna()))
+    df["code"] = df["code_ref"].map(payloads).fillna(inline[2].replace("", None))
+    df["logs"] = df["logs_ref"].map(payloads)
+    df = df.drop(columns=["response_ref", "code_ref", "logs_ref"])
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    df.to_parquet(output_path, index=False)
+    return len(df)
+
+
+def storage_report(sample=20, repeats=5):
+    '''
+    Database size and conversation read latency.
+    Inputs:
+        - sample (int): number of conversations timed with get_conversation
+        - repeats (int): reads per conversation
+    Output: dict with db_bytes, turns, payloads, payload_raw_bytes, payload_stored_bytes,
+            inline_bytes, read_ms_median, read_ms_p95
+    '''
+    with sqlite3.connect(DB_PATH) as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        turns, inline_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length(response)), 0) FROM conversation_history"
+        ).fetchone()
+        payloads, raw, stored = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(stored_size), 0) FROM payloads"
+        ).fetchone()
+        conv_ids = [r[0] for r in conn.execute(
+            "SELECT conv_id FROM conversation_history GROUP BY conv_id ORDER BY MAX(turn_id) DESC LIMIT ?", (sample,)
+        )]
+
+    timings = []
+    for conv_id in conv_ids:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            get_conversation(conv_id)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "db_bytes": page_size * pages,
+        "free_bytes": page_size * free,
+        "turns": turns,
+        "inline_bytes": inline_bytes,
+        "payloads": payloads,
+        "payload_raw_bytes": raw,
+        "payload_stored_bytes": stored,
+        "read_ms_median": statistics.median(timings) if timings else None,
+        "read_ms_p95": timings[int(0.95 * (len(timings) - 1))] if timings else None,
+    }
+
+
+def print_report(label, report):
+    def mb(v):
+        return f"{v / 1e6:.2f} MB"
+    read = (f"{report['read_ms_median']:.2f} ms median, {report['read_ms_p95']:.2f} ms p95"
+            if report["read_ms_median"] is not None else "-")
+    print(f"{label}: db {mb(report['db_bytes'])} (free {mb(report['free_bytes'])}), {report['turns']} turns, "
+          f"inline {mb(report['inline_bytes'])}, {report['payloads']} payloads "
+          f"{mb(report['payload_raw_bytes'])} -> {mb(report['payload_stored_bytes'])}; read {read}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation history storage maintenance.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_compact = sub.add_parser("compact", help="move payloads out of line, apply retention, reclaim space")
+    p_compact.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    p_compact.add_argument("--batch-size", type=int, default=COMPACT_BATCH)
+    p_compact.add_argument("--max-batches", type=int)
+    p_compact.add_argument("--vacuum", action="store_true", help="full VACUUM at the end")
+    p_export = sub.add_parser("export", help="export turns to Parquet")
+    p_export.add_argument("output", help="target .parquet file")
+    p_export.add_argument("--since", help='timestamp lower bound, e.g. "20250101-000000"')
+    sub.add_parser("report", help="database size and read latency")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "compact":
+        print_report("before", storage_report())
+        stats = compact(args.retention_days, args.batch_size, args.max_batches, args.vacuum)
+        print(f"🧹 migrated {stats['migrated']} turns, expired {stats['expired']} turns, "
+              f"{stats['spans_expired']} trace spans and {stats['cache_events_expired']} cache events, "
+              f"removed {stats['payloads_removed']} payloads")
+        print_report("after ", storage_report())
+    elif args.command == "export":
+        print(f"✅ Exported {export_parquet(args.output, args.since)} turns to {args.output}")
+    else:
+        print_report("report", storage_report())
+
+
+if __name__ == "__main__":
+    main()
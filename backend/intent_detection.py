@@ -7,6 +7,7 @@ with an optional LLM fallback.
 import os
 import json
 from groq import Groq
+from backend.tracing import span, record_llm_usage
 
 groq_api_key = os.environ.get("GROQ_API_KEY1")
 client = Groq(api_key = groq_api_key)
@@ -113,16 +114,18 @@ def llm_route(user_input: str):
     """
     
     try:
-        completion = client.chat.completions.create(
-          #  model="llama-3.3-70b-versatile",
-            model="openai/gpt-oss-120b",
-            messages=[
-                {
-                    "role": "user",
-                    "content": few_shot_prompt
-                }
-            ]
-        )
+        with span("llm.routing", model="openai/gpt-oss-120b") as attrs:
+            completion = client.chat.completions.create(
+              #  model="llama-3.3-70b-versatile",
+                model="openai/gpt-oss-120b",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": few_shot_prompt
+                    }
+                ]
+            )
+            record_llm_usage(attrs, completion)
         resp = completion.choices[0].message.content.strip()
         parsed = extract_json(resp)
         return parsed
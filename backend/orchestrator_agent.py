@@ -1,20 +1,98 @@
 # orchestrator_agent.py
 import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 
-from backend.intent_detection import get_intent
-from backend.scenario_editor import run_scenario_agent
+from backend.intent_detection import get_intent, rule_based_route, use_llm
+from backend.scenario_editor import run_scenario_agent, load_target_sheet
 
-from backend.rag_engine import query_rag
+from backend.rag_engine import query_rag, retrieve_for_rag
 from backend.conv_history import init_db, new_conversation, log_turn
+from backend.tracing import init_trace_table, trace, span, stage_breakdown
+from backend.version_store import init_version_table, record_version
+from backend.code_cache import init_code_cache_table
 
 PKT = timezone(timedelta(hours=5))
 
 # Ensure DB is ready once
 init_db()
+init_trace_table()
+init_version_table()
+init_code_cache_table()
 base_scenario_path = r"D:\lums-python-programming\thesis\wit-messageix-docs\MESSAGEix-Pakistan-CurPol.xlsx"
 
-def orchestrate(instruction, input_file=None):
+# Speculative mode: while LLM routing runs, start retrieval and sheet loading for both agents
+SPECULATIVE = os.environ.get("PEACH_SPECULATIVE", "1") != "0"
+speculation_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculate")
+
+
+def submit_speculative(stage, fn, *args, **kwargs):
+    """
+    Run fn on the speculation pool in a copy of the current context, so its spans
+    stay attached to the request trace. Start/end times are kept on the future.
+    """
+    ctx = contextvars.copy_context()
+    timing = {}
+
+    def run():
+        timing["start"] = time.perf_counter()
+        try:
+            with span(stage):
+                return fn(*args, **kwargs)
+        finally:
+            timing["end"] = time.perf_counter()
+
+    future = speculation_pool.submit(ctx.run, run)
+    future.timing = timing
+    return future
+
+
+def discard_speculative(future):
+    """
+    Cancel a speculative branch that routing did not pick.
+    Output: (wasted work in ms, state: "cancelled" / "finished" / "running")
+    """
+    if future.cancel():
+        return 0.0, "cancelled"
+    timing = future.timing
+    if "end" in timing:
+        return (timing["end"] - timing["start"]) * 1000, "finished"
+    if "start" in timing:
+        return (time.perf_counter() - timing["start"]) * 1000, "running"
+    return 0.0, "cancelled"
+
+
+def start_speculation(instruction, scenario_file, uploaded, parent_version_id):
+    """Start both agents' data loading before routing has decided between them."""
+    return {
+        "rag": submit_speculative("speculative.rag", retrieve_for_rag, instruction),
+        "scenario_editor": submit_speculative(
+            "speculative.scenario_editor", load_target_sheet, instruction, scenario_file, uploaded, parent_version_id
+        ),
+    }
+
+
+def commit_speculation(speculation, mode):
+    """
+    Keep the branch routing picked and discard the other.
+    Output: result of the picked branch, or None if it failed (the agent then redoes the work itself)
+    """
+    with span("speculation", branch=mode) as attrs:
+        wasted_ms, state = 0.0, None
+        for branch, future in speculation.items():
+            if branch != mode:
+                wasted_ms, state = discard_speculative(future)
+        attrs["wasted_ms"] = round(wasted_ms, 1)
+        attrs["wasted_state"] = state
+        try:
+            return speculation[mode].result()
+        except Exception as e:
+            attrs["error"] = f"{type(e).__name__}: {e}"[:300]
+            return None
+
+def orchestrate(instruction, input_file=None, input_name=None, parent_version_id=None):
     print("ORCHESTRATE CALLED WITH:", repr(instruction))
 
     """
@@ -22,14 +100,35 @@ def orchestrate(instruction, input_file=None):
     - intent detection
     - agent routing
     - DB logging
+    Every call is traced; the per-stage breakdown is returned under "trace".
+    input_name is the user-facing file name of input_file (uploads are stored under their content hash).
+    parent_version_id chains a scenario edit onto an earlier version instead of the input file itself.
+    Edits are stored as deltas; the returned output_file is only written by version_store.materialize_to_file.
     """
-    uploaded = input_file is not None
     timestamp = datetime.now(PKT).strftime("%Y%m%d-%H%M%S")
 
     # ---- conversation lifecycle ----
     conv_id = new_conversation()
 
-    routing = get_intent(instruction)
+    with trace(conv_id) as current_trace:
+        with span("orchestrate"):
+            result = route_and_run(instruction, input_file, input_name, parent_version_id, conv_id, timestamp)
+
+    result["trace"] = stage_breakdown(current_trace)
+    return result
+
+
+def route_and_run(instruction, input_file, input_name, parent_version_id, conv_id, timestamp):
+    """Detect intent, run the selected agent and log the turn (called inside the request trace)."""
+    uploaded = input_file is not None
+
+    # speculate only when routing will wait on the LLM (rule-based "scenario_editor" is final)
+    speculation = None
+    if SPECULATIVE and use_llm and rule_based_route(instruction)["selected_agent"] == "rag":
+        speculation = start_speculation(instruction, input_file or base_scenario_path, uploaded, parent_version_id)
+
+    with span("routing"):
+        routing = get_intent(instruction)
     mode = routing["selected_agent"]
     routing_reason = routing.get("reason", "")
 
@@ -40,38 +139,53 @@ def orchestrate(instruction, input_file=None):
 
         output_file = os.path.join(
                 "data/history/outputs",
-                os.path.basename(input_file).replace(".xlsx", f"-updated-{timestamp}.xlsx")
+                os.path.basename(input_name or input_file).replace(".xlsx", f"-updated-{timestamp}.xlsx")
             )
 
-        result = run_scenario_agent(
-            instruction=instruction,
-            input_file=input_file,
-            uploaded=uploaded,
-            output_file=output_file
-        )
+        target = commit_speculation(speculation, mode) if speculation else None
 
-        reply = f"✅ Scenario updated: `{os.path.basename(output_file)}`"
+        with span("scenario_editor"):
+            result = run_scenario_agent(
+                instruction=instruction,
+                input_file=input_file,
+                uploaded=uploaded,
+                parent_version_id=parent_version_id,
+                target=target
+            )
 
-        stored_reply = (
-            f"{reply}\n\n"
-            f"Generated code:\n{result.get('code')}"
-        )
+        version_id = None
+        if result.get("success"):
+            with span("version_store"):
+                version_id = record_version(
+                    result["df_input"], result["df"], result["sheet_name"],
+                    base_path=input_file, parent_id=parent_version_id
+                )
+            reply = f"✅ Scenario updated: `{os.path.basename(output_file)}`"
+        else:
+            reply = f"❌ Scenario update failed on sheet '{result.get('sheet_name')}'. See the execution logs."
 
         # ---- DB LOGGING ----
-        log_turn(
-            conv_id=conv_id,
-            mode=mode,
-            routing_reason=routing_reason,
-            timestamp=timestamp,
-            query=instruction,
-            response=stored_reply,
-            output_file_name=os.path.basename(output_file)
-        )
+        with span("db_write"):
+            log_turn(
+                conv_id=conv_id,
+                mode=mode,
+                routing_reason=routing_reason,
+                timestamp=timestamp,
+                query=instruction,
+                response=reply,
+                output_file_name=os.path.basename(output_file) if version_id else None,
+                version_id=version_id,
+                parent_version_id=parent_version_id,
+                code=result.get("code"),
+                logs=result.get("logs")
+            )
 
         return {
             "mode": mode,
             "reply": reply,
-            "output_file": output_file,
+            "output_file": output_file if version_id else None,
+            "version_id": version_id,
+            "parent_version_id": parent_version_id,
             "code": result.get("code"),
             "logs": result.get("logs"),
             "timestamp": timestamp
@@ -79,17 +193,21 @@ def orchestrate(instruction, input_file=None):
 
     # ---------- RAG ----------
     elif mode == "rag":
-        reply = query_rag(instruction)
-
-        log_turn(
-            conv_id=conv_id,
-            mode=mode,
-            routing_reason=routing_reason,
-            timestamp=timestamp,
-            query=instruction,
-            response=reply,
-            output_file_name=None
-        )
+        results = commit_speculation(speculation, mode) if speculation else None
+
+        with span("rag"):
+            reply = query_rag(instruction, workbook=input_file or base_scenario_path, results=results)
+
+        with span("db_write"):
+            log_turn(
+                conv_id=conv_id,
+                mode=mode,
+                routing_reason=routing_reason,
+                timestamp=timestamp,
+                query=instruction,
+                response=reply,
+                output_file_name=None
+            )
 
         return {
             "mode": mode,
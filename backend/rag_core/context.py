@@ -0,0 +1,158 @@
+import re
+
+# same estimate as the docx chunker, so chunk and context budgets count tokens alike
+from backend.rag_core.tokens import estimate_tokens
+
+WORD_PATTERN = re.compile(r"[a-z0-9_]+")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "is", "are", "was", "were", "be",
+    "what", "which", "who", "where", "when", "why", "how", "does", "do", "did", "can", "could",
+    "should", "would", "will", "with", "by", "from", "at", "as", "it", "its", "this", "that",
+    "these", "those", "there", "me", "my", "i", "you", "about", "all", "any", "sheet", "value", "values"
+}
+
+
+def query_terms(query):
+    '''
+    Extract the content words of a query (lowercased, stopwords removed).
+    '''
+    return {w for w in WORD_PATTERN.findall(query.lower()) if len(w) > 1 and w not in STOPWORDS}
+
+
+def shingles(text, n=5):
+    '''
+    Word n-gram shingles of a text, used for near-duplicate detection.
+    '''
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def deduplicate_chunks(bodies, threshold=0.8):
+    '''
+    Drop near-identical chunks, keeping the first (most relevant) occurrence.
+    Inputs:
+        - bodies (list): chunk texts, ordered by relevance
+        - threshold (float): Jaccard similarity of word shingles above which two chunks count as duplicates
+    Output:
+        keep (list): indices of the chunks to keep
+    '''
+    keep, kept_shingles = [], []
+    for i, body in enumerate(bodies):
+        s = shingles(body)
+        duplicate = False
+        for other in kept_shingles:
+            union = len(s | other)
+            if union and len(s & other) / union >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            keep.append(i)
+            kept_shingles.append(s)
+    return keep
+
+
+def is_xlsx_chunk(doc_title, body):
+    return str(doc_title).lower().endswith(".xlsx") and body.lstrip().startswith("Sheet: ")
+
+
+def trim_xlsx_chunk(body, terms, max_rows=15):
+    '''
+    Trim an XLSX chunk to the rows and columns relevant to the query.
+    The "Sheet:" line is always kept. Rows mentioning the most query terms are kept (or
+    the first rows if none match); columns that hold the same value in every kept row and
+    are not named in the query are folded into a single "Constant:" line.
+
+    Inputs:
+        - body (str): chunk text as produced by xlsx_parser.excel_parse
+        - terms (set): query terms (see query_terms)
+        - max_rows (int): maximum number of data rows to keep
+    Output:
+        trimmed chunk text (str)
+    '''
+    lines = [line.strip() for line in body.strip().split("\n")]
+    if len(lines) < 2 or not lines[1].startswith("Header: "):
+        return body
+    sheet_line = lines[0]
+    header = [h.strip() for h in lines[1][len("Header: "):].split(",")]
+    rows = [line for line in lines[2:] if line]
+
+    # rank rows by the number of query terms they mention, keep the best in sheet order
+    scores = [sum(t in row.lower() for t in terms) for row in rows]
+    relevant = sorted((i for i, score in enumerate(scores) if score), key=lambda i: -scores[i])[:max_rows]
+    kept = [rows[i] for i in sorted(relevant)] if relevant else rows[:max_rows]
+    omitted = len(rows) - len(kept)
+
+    # column trimming only applies when every kept row splits cleanly into the header columns
+    split_rows = [row.split(", ") for row in kept]
+    if not kept or any(len(cells) != len(header) for cells in split_rows):
+        out = [sheet_line, lines[1]] + kept
+    else:
+        keep_cols, constants = [], []
+        for j, name in enumerate(header):
+            column = {cells[j] for cells in split_rows}
+            named_in_query = any(t in name.lower() for t in terms)
+            if len(column) == 1 and len(kept) > 1 and not named_in_query:
+                value = next(iter(column))
+                if value:
+                    constants.append(f"{name}={value}")
+            else:
+                keep_cols.append(j)
+        out = [sheet_line, f"Header: {', '.join(header[j] for j in keep_cols)}"]
+        if constants:
+            out.append(f"Constant: {', '.join(constants)}")
+        out.extend(", ".join(cells[j] for j in keep_cols) for cells in split_rows)
+
+    if omitted > 0:
+        out.append(f"... {omitted} more rows not shown")
+    return "\n".join(out)
+
+
+def assemble_context(query, results, max_tokens=1200, dedup_threshold=0.8):
+    '''
+    Build the LLM context from retrieved chunks under a token budget.
+    Chunks are ordered by similarity, near-duplicates are dropped, XLSX chunks are
+    trimmed to the query-relevant rows/columns, and chunks are added until the budget
+    is reached.
+
+    Inputs:
+        - query (str): user's question
+        - results (pd.DataFrame): retrieved chunks with docTitle, body and (optionally) similarity
+        - max_tokens (int): token budget for the assembled context
+        - dedup_threshold (float): shingle Jaccard similarity treated as a duplicate
+    Outputs:
+        - context (str): chunk texts joined by blank lines
+        - docTitles (list): titles of the documents that made it into the context
+        - stats (dict): token counts before/after and number of chunks dropped at each stage
+    '''
+    if "similarity" in results.columns:
+        results = results.sort_values("similarity", ascending=False)
+    titles = list(results["docTitle"])
+    bodies = [str(b) for b in results["body"]]
+    tokens_in = sum(estimate_tokens(b) for b in bodies)
+
+    keep = deduplicate_chunks(bodies, dedup_threshold)
+    terms = query_terms(query)
+
+    parts, used_titles, used = [], [], 0
+    for i in keep:
+        body = bodies[i]
+        if is_xlsx_chunk(titles[i], body):
+            body = trim_xlsx_chunk(body, terms)
+        cost = estimate_tokens(body)
+        if parts and used + cost > max_tokens:
+            continue  # a smaller, lower-ranked chunk may still fit
+        parts.append(body)
+        used += cost
+        if titles[i] not in used_titles:
+            used_titles.append(titles[i])
+
+    stats = {
+        "chunks_in": len(bodies),
+        "chunks_deduplicated": len(bodies) - len(keep),
+        "chunks_out": len(parts),
+        "tokens_in": tokens_in,
+        "tokens_out": used,
+    }
+    return "\n\n".join(parts), used_titles, stats
@@ -1,5 +1,6 @@
 import os
 from groq import Groq
+from backend.tracing import span, record_llm_usage
 
 
 groq_api_key = os.environ.get("GROQ_API_KEY1")
@@ -35,15 +36,17 @@ def generate_answer(query, context, docTitles, llm_model_name="openai/gpt-oss-12
         Mention the source document titles at the end of the answer.
     """
 
-    completion = client.chat.completions.create(
-            model=llm_model_name, 
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
+    with span("llm.answer", model=llm_model_name) as attrs:
+        completion = client.chat.completions.create(
+                model=llm_model_name, 
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
+            )
+        record_llm_usage(attrs, completion)
     response = completion.choices[0].message.content
 
     return response
@@ -1,5 +1,7 @@
 import faiss
+import numpy as np
 from pathlib import Path
+from backend.tracing import span
 
 # --- configuration ---
 BASE_DIR = Path(r"D:\lums-python-programming\thesis\project")
@@ -10,11 +12,139 @@ INDEX_PATH = RAG_STORE_DIR / "faiss_hnsw_index.faiss"
 META_PATH  = RAG_STORE_DIR / "rag_metadata.parquet"
 EMBEDDING_MODEL = "intfloat/e5-small-v2"      # or "all-MiniLM-L6-v2"
 
+EXACT_SEARCH_FRACTION = 0.2 # filters selecting at most this share of the index are searched exactly
+EXACT_SEARCH_MAX = 20000    # ... and at most this many chunks (vectors are copied into a flat index)
+MAX_EF_SEARCH = 1024        # cap on efSearch for broad filters searched through the HNSW graph
 
-def retrieve_chunks(query, model, index, metadata, k=10, for_rag=False):
+_selections = {}        # (id(metadata), filter) -> selected index IDs
+_selectors = {}         # (id(metadata), filter) -> (FAISS IDSelector, number of selected chunks)
+_exact_indexes = {}     # (id(index), ntotal, id(metadata), filter) -> (flat index over the selection, its IDs)
+
+
+def add_filter_columns(metadata):
+    '''
+    Make sure metadata has the columns used for filtered search:
+    docType (file extension of docTitle) and sheetName (workbook chunks only, from their "Sheet: ..." line).
+    Rows indexed before these columns existed are filled in place.
+    '''
+    if "docType" not in metadata.columns or metadata["docType"].isna().any():
+        doc_types = metadata["docTitle"].str.rsplit(".", n=1).str[-1].str.lower()
+        metadata["docType"] = metadata["docType"].fillna(doc_types) if "docType" in metadata.columns else doc_types
+    if "sheetName" not in metadata.columns or metadata["sheetName"].isna().any():
+        sheets = metadata["body"].astype(str).str.extract(r"^Sheet: ([^\n]*)", expand=False).str.strip()
+        sheets = sheets.where(metadata["docType"] == "xlsx")
+        metadata["sheetName"] = metadata["sheetName"].fillna(sheets) if "sheetName" in metadata.columns else sheets
+    return metadata
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _filter_key(metadata, doc_title=None, doc_type=None, sheet=None):
+    doc_title, doc_type, sheet = _as_list(doc_title), _as_list(doc_type), _as_list(sheet)
+    if not (doc_title or doc_type or sheet):
+        return None
+    return (id(metadata), tuple(doc_title or ()), tuple(doc_type or ()), tuple(sheet or ()))
+
+
+def select_ids(metadata, doc_title=None, doc_type=None, sheet=None):
+    '''
+    Index IDs (metadata row positions) of the chunks matching the filters, cached per filter.
+    Output: np.ndarray of int64, or None if no filter is given
+    '''
+    key = _filter_key(metadata, doc_title, doc_type, sheet)
+    if key is None:
+        return None
+    if key in _selections:
+        return _selections[key]
+
+    add_filter_columns(metadata)
+    mask = np.ones(len(metadata), dtype=bool)
+    if doc_title:
+        mask &= metadata["docTitle"].isin(_as_list(doc_title)).to_numpy()
+    if doc_type:
+        mask &= metadata["docType"].isin([t.lower().lstrip(".") for t in _as_list(doc_type)]).to_numpy()
+    if sheet:
+        mask &= metadata["sheetName"].isin(_as_list(sheet)).to_numpy()
+    _selections[key] = np.flatnonzero(mask).astype("int64")
+    return _selections[key]
+
+
+def build_selector(metadata, doc_title=None, doc_type=None, sheet=None):
+    '''
+    FAISS ID selector for the chunks matching the filters. Index IDs are metadata row positions
+    and documents are added one after another, so a single document is a contiguous ID range
+    (IDSelectorRange); other selections use an IDSelectorBatch. Selectors are cached per filter.
+
+    Inputs:
+        - metadata: metadata store, accompanying the FAISS index
+        - doc_title (str or list): restrict to these documents
+        - doc_type (str or list): restrict to document types, e.g. "xlsx" / "docx"
+        - sheet (str or list): restrict to workbook chunks of these sheets
+    Outputs:
+        - (selector, count): FAISS IDSelector (None if no filter) and number of selected chunks
+    '''
+    key = _filter_key(metadata, doc_title, doc_type, sheet)
+    if key is None:
+        return None, len(metadata)
+    if key in _selectors:
+        return _selectors[key]
+
+    ids = select_ids(metadata, doc_title, doc_type, sheet)
+    if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+        selector = faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+    else:
+        selector = faiss.IDSelectorBatch(ids)
+    _selectors[key] = (selector, len(ids))
+    return _selectors[key]
+
+
+def exact_index(index, metadata, doc_title=None, doc_type=None, sheet=None):
+    '''
+    Flat index over the vectors of the selected chunks, with the metric of the main index,
+    reconstructed from the HNSW index and cached per filter. HNSW search with a selector still
+    walks the whole graph, so a small selection can come back empty or partial; the flat index
+    searches it exactly and returns scores comparable with an unfiltered search.
+    Output: (faiss.IndexFlat, IDs of its rows in the full index)
+    '''
+    key = (id(index), index.ntotal) + _filter_key(metadata, doc_title, doc_type, sheet)
+    if key not in _exact_indexes:
+        ids = select_ids(metadata, doc_title, doc_type, sheet)
+        if ids[-1] - ids[0] + 1 == len(ids):
+            vectors = index.reconstruct_n(int(ids[0]), len(ids))
+        else:
+            vectors = index.reconstruct_batch(ids)
+        flat = faiss.IndexFlat(index.d, index.metric_type)
+        flat.add(np.ascontiguousarray(vectors, dtype="float32"))
+        _exact_indexes[key] = (flat, ids)
+    return _exact_indexes[key]
+
+
+def is_small_selection(index, selected):
+    '''True if a filter selects few enough chunks to be searched exactly rather than through HNSW.'''
+    return selected <= min(EXACT_SEARCH_MAX, EXACT_SEARCH_FRACTION * index.ntotal)
+
+
+def to_similarity(index, scores):
+    '''
+    FAISS scores as similarities (higher = closer). Embeddings are normalized, so the squared
+    L2 distance d of an L2 index becomes the cosine similarity 1 - d/2; inner products already are.
+    '''
+    if index.metric_type == faiss.METRIC_L2:
+        return 1 - scores / 2
+    return scores
+
+
+def retrieve_chunks(query, model, index, metadata, k=10, for_rag=False, doc_title=None, doc_type=None, sheet=None):
     '''
     Retrieve the top-k relevant document chunks from FAISS index for a given query based on semantic similarity,
     get their metedata from metadata store, and return as a DataFrame.
+    Optional filters restrict the search inside FAISS, so only matching chunks are scored: small selections
+    (see is_small_selection) are searched exactly, broader ones through HNSW with an ID selector, falling
+    back to an exact search if the graph walk can't fill k slots.
     
     Inputs:
         - query (str): user query 
@@ -23,16 +153,38 @@ def retrieve_chunks(query, model, index, metadata, k=10, for_rag=False):
         - metadata: metadata store, accompanying the FAISS index
         - k (int): no. of top similar chunks to retrieve
         - for_rag (bool): whether retrieval is for RAG or other usecases
+        - doc_title / doc_type / sheet (str or list, optional): see build_selector
     Outputs:
         - results (pd.DataFrame): top-k relevant document chunks with metadata
+          (fewer than k, possibly none, if the filters select fewer chunks)
     '''
     
-    q_emb = model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
-    faiss.normalize_L2(q_emb)
-    D, I = index.search(q_emb, k)             # D -> np array of similarities, I -> indices for rows stored in metadata
-    results = metadata.iloc[I[0]].copy()
-    results["similarity"] = D[0]
+    with span("encode"):
+        q_emb = model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+        faiss.normalize_L2(q_emb)
+    selector, selected = build_selector(metadata, doc_title, doc_type, sheet)
+    with span("faiss", k=k, filtered=selector is not None, selected=selected):
+        if selector is None:
+            D, I = index.search(q_emb, k)             # D -> np array of scores (see to_similarity), I -> indices for rows stored in metadata
+        elif selected == 0:
+            D, I = np.empty((1, 0), dtype="float32"), np.empty((1, 0), dtype="int64")
+        else:
+            k = min(k, selected)
+            D = I = None
+            if not is_small_selection(index, selected):
+                # broad filter: widen the beam by how much of the index the filter removes
+                ef = max(index.hnsw.efSearch, k) * max(1, round(index.ntotal / selected))
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(k, min(ef, MAX_EF_SEARCH)))
+                D, I = index.search(q_emb, k, params=params)
+            if I is None or (I[0] < 0).any():
+                # small selection, or the graph walk stayed among unselected chunks: search exactly
+                flat, ids = exact_index(index, metadata, doc_title, doc_type, sheet)
+                D, I = flat.search(q_emb, k)
+                I = np.where(I >= 0, ids[np.maximum(I, 0)], -1)
+    found = I[0] >= 0                              # -1 marks slots FAISS could not fill
+    results = metadata.iloc[I[0][found]].copy()
+    results["similarity"] = to_similarity(index, D[0][found])
     results = results.sort_values("similarity", ascending=False).reset_index(drop=True)
     if for_rag:
-        return results[["docTitle", "body"]]  # minimal for LLM
-    return results
\ No newline at end of file
+        return results[["docTitle", "body", "similarity"]]  # minimal for LLM
+    return results
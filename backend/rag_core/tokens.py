@@ -0,0 +1,13 @@
+import re
+
+# shared by the docx chunker (chunk budget) and context assembly (context budget)
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    '''
+    Approximate the token count of a text for the embedding model.
+    Counts words and punctuation marks separately, which tracks WordPiece
+    token counts closely enough to keep chunks under the model's input limit.
+    '''
+    return len(TOKEN_PATTERN.findall(text))
@@ -1,17 +1,42 @@
+import os
 from urllib import response
-from backend.config.rag_config import load_rag_resources
+from backend.config.rag_config import load_rag_resources, RAG_TOP_K, CONTEXT_TOKEN_BUDGET, DEDUP_THRESHOLD
 from backend.rag_core.retriever import retrieve_chunks
 from backend.rag_core.generator import generate_answer
+from backend.rag_core.context import assemble_context
+from backend.table_query import is_data_question, query_table
 
 # Cached load: only runs once when app starts
 model, index, metadata = load_rag_resources()
 
-def query_rag(query):
-    """Run the RAG pipeline: retrieve → generate → return answer"""
-    results = retrieve_chunks(query, model, index, metadata, k=5, for_rag=True)
-    texts = [text for text in results["body"]]
-    docs = "\n\n".join(texts)
-    docTitles = list(set(results['docTitle']))
+def retrieve_for_rag(query):
+    """Embed the query and search the index (the retrieval stage of query_rag)."""
+    return retrieve_chunks(query, model, index, metadata, k=RAG_TOP_K, for_rag=True)
+
+
+def query_rag(query, workbook=None, results=None):
+    """
+    Run the RAG pipeline: retrieve → assemble context → generate → return answer.
+    Data questions about a scenario workbook are answered from a structured query
+    over its sheets instead, falling back to document retrieval if that fails.
+    results: output of retrieve_for_rag when retrieval already ran (e.g. speculatively).
+    """
+    if workbook and is_data_question(query, workbook):
+        table = query_table(query, workbook, model)
+        if table is not None:
+            docs = (
+                f"Result of SQL query over sheets {', '.join(table['sheets'])}:\n{table['sql']}\n\n"
+                f"{table['result'].to_csv(index=False)}"
+            )
+            docTitle = f"{os.path.basename(workbook)} ({', '.join(table['sheets'])})"
+            return generate_answer(query, docs, [docTitle])
+
+    if results is None:
+        results = retrieve_for_rag(query)
+    docs, docTitles, stats = assemble_context(query, results, max_tokens=CONTEXT_TOKEN_BUDGET,
+                                              dedup_threshold=DEDUP_THRESHOLD)
+    print(f"Context: {stats['chunks_out']}/{stats['chunks_in']} chunks, "
+          f"~{stats['tokens_out']}/{stats['tokens_in']} tokens")
     reply = generate_answer(query, docs, docTitles)
 
     return reply
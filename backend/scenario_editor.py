@@ -1,51 +1,75 @@
-import pandas as pd
 import numpy as np
-import re
 import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from backend.config.rag_config import load_rag_resources
-from backend.rag_core.retriever import retrieve_chunks
+from backend.rag_core.retriever import retrieve_chunks, add_filter_columns
 from groq import Groq
-
+from backend.tracing import span, record_llm_usage
+from backend.sheet_cache import sheet_names as cached_sheet_names, load_sheet
+from backend.sheet_catalog import build_catalog, sheet_embeddings, summarize_sheet, describe_for_prompt
+from backend.version_store import load_version_sheet
+from backend import code_cache
+from backend.code_sandbox import clean_code, run_candidate
+
+# reuse validated code for repeated instructions on sheets with the same schema
+CODE_CACHE = os.environ.get("PEACH_CODE_CACHE", "1") != "0"
+
+# Candidate programs requested concurrently per round (1 = serial fix-and-retry)
+CODEGEN_CANDIDATES = int(os.environ.get("PEACH_CODEGEN_CANDIDATES", "1"))
+PARALLEL_ROUNDS = 2             # rounds when candidates > 1: first round + one round with error feedback
+CANDIDATE_TEMPERATURE = 0.7
+MAX_FEEDBACK_ERRORS = 3
+
+
+class CandidateFailed(Exception):
+    """A generated program that failed validation, execution or the invariant checks."""
+    def __init__(self, code, error, gen_ms):
+        super().__init__(str(error))
+        self.code = code
+        self.error = error
+        self.gen_ms = gen_ms
 
 groq_api_key = os.environ.get("GROQ_API_KEY1")
 client = Groq(api_key = groq_api_key)
 
 embedding_model, index, metadata = load_rag_resources()
+add_filter_columns(metadata)
+indexed_workbooks = set(metadata.loc[metadata["docType"] == "xlsx", "docTitle"])
 
 def read_uploaded_file_data(file_path, query):
-    xls = pd.ExcelFile(file_path)
-    sheet_names = xls.sheet_names
+    # sheets and their descriptions come from the workbook catalog, which uploads build in the background
+    sheet_names = list(build_catalog(file_path))
     if len(sheet_names) > 1:
-        q_emb = embedding_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
-        sheet_embs = [embedding_model.encode([sheet_name], convert_to_numpy=True, normalize_embeddings=True) for sheet_name in sheet_names]
+        with span("sheet_select", sheets=len(sheet_names)):
+            q_emb = embedding_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+            sheet_names, sheet_embs = sheet_embeddings(file_path, embedding_model)
 
-        scores = [np.dot(q_emb, sheet_emb.T).item() for sheet_emb in sheet_embs]
-        best_idx = np.argmax(scores)
-        best_sheet = sheet_names[best_idx]        
+            scores = sheet_embs @ q_emb[0]
+            best_idx = np.argmax(scores)
+            best_sheet = sheet_names[best_idx]        
     else:
         best_sheet = sheet_names[0]
         
     print(f"Best matching sheet: {best_sheet}")
-    for sheet in sheet_names:
-        if sheet == best_sheet:
-            df = xls.parse(sheet)
-            return df, best_sheet
+    with span("sheet_load", sheet=best_sheet):
+        df = load_sheet(file_path, best_sheet)
+    return df, best_sheet
 
-def run_scenario_agent(instruction, input_file, uploaded, output_file, max_retries=3):
+def load_target_sheet(instruction, input_file, uploaded, parent_version_id=None):
     """
-    Reads Excel, gets transformation code from model, executes it safely, saves new file.
-    Returns structured output for front-end.
+    Pick the sheet an instruction refers to and load it.
+    Runs independently of the rest of the agent, so orchestrate can start it speculatively.
     Inputs:
     - instruction (str): User's instruction for Excel manipulation
-  #  - uploaded (bool): Whether file was uploaded in input
     - input_file (str): Path to input Excel file
-    - output_file (str): Path to save updated Excel file
-    - max_retries (int): Number of retries for code execution on failure
+    - uploaded (bool): Whether file was uploaded in input
+    - parent_version_id (str, optional): Scenario version to load the sheet from instead of input_file
 
     Outputs:
-    - dict with keys: success (bool), code (str), logs (str)
+    - df_input (pd.DataFrame), target_sheet_name (str), logs (list)
     """
-    
     logs = []
 
     df_input, target_sheet_name = None, None
@@ -56,26 +80,70 @@ def run_scenario_agent(instruction, input_file, uploaded, output_file, max_retri
         logs.append(f"🔍 Identified target sheet: '{target_sheet_name}'")
     else:
         retriever_query = f"which MESSAGEix-Pakistan-CurPol sheet has information about this query: {instruction}"
-        results = retrieve_chunks(retriever_query, embedding_model, index, metadata, k=1, for_rag=True)
+        # search only workbook chunks (of this workbook, if it is indexed), never the docx documentation
+        workbook = os.path.basename(input_file)
+        scope = {"doc_title": workbook} if workbook in indexed_workbooks else {"doc_type": "xlsx"}
+        results = retrieve_chunks(retriever_query, embedding_model, index, metadata, k=1, **scope)
      #   print(results['body'][0])
-        target_sheet_name = results['body'][0].split('\n')[0]
-        target_sheet_name = target_sheet_name.replace('Sheet: ', '')
+        if results.empty:
+            raise ValueError(f"❌ No indexed sheet matches this instruction for {workbook}.")
+        target_sheet_name = results['sheetName'][0]
         logs.append(f"🔍 Identified target sheet: '{target_sheet_name}'")
 
-        xls = pd.ExcelFile(input_file)
-        for sheet_name in xls.sheet_names:
-            if sheet_name == target_sheet_name:
-                df_input = xls.parse(sheet_name)
-                break
+        if target_sheet_name in cached_sheet_names(input_file):
+            with span("sheet_load", sheet=target_sheet_name):
+                df_input = load_sheet(input_file, target_sheet_name)
         #logs.append(f"🔍 Identified target sheet: '{target_sheet_name}'")
 
 
     if df_input is None:
         raise ValueError(f"❌ No sheet named '{target_sheet_name}' found in {input_file}.")
 
+    if parent_version_id:
+        df_input = load_version_sheet(parent_version_id, target_sheet_name)
+        logs.append(f"🗂️ Editing on top of scenario version {parent_version_id}")
+
+    return df_input, target_sheet_name, logs
+
+
+def run_scenario_agent(instruction, input_file, uploaded, output_file=None, max_retries=3, parent_version_id=None,
+                       target=None, candidates=None):
+    """
+    Reads Excel, gets transformation code from model, executes it safely, saves new file.
+    Returns structured output for front-end.
+    Inputs:
+    - instruction (str): User's instruction for Excel manipulation
+  #  - uploaded (bool): Whether file was uploaded in input
+    - input_file (str): Path to input Excel file
+    - output_file (str, optional): Path to save updated Excel file (None = don't write, see version_store)
+    - max_retries (int): Number of retries for code execution on failure (serial mode)
+    - parent_version_id (str, optional): Scenario version to edit instead of the sheet in input_file
+    - target (tuple, optional): Result of load_target_sheet if it already ran (e.g. speculatively)
+    - candidates (int, optional): Candidate programs generated and executed in parallel per round
+      (default CODEGEN_CANDIDATES; with more than one, at most PARALLEL_ROUNDS rounds run)
+
+    Outputs:
+    - dict with keys: success (bool), code (str), logs (str),
+      sheet_name (str), df_input / df (pd.DataFrame) - the sheet before and after the edit
+    """
+    if target is None:
+        target = load_target_sheet(instruction, input_file, uploaded, parent_version_id)
+    df_input, target_sheet_name, logs = target
+    logs = list(logs)
+
     logs.append("📄 Loaded Excel file successfully.")
     logs.append(f"Columns: {list(df_input.columns)}")
 
+    # exact columns, year ranges and value vocabularies, so the model doesn't guess names from 5 rows
+    with span("catalog"):
+        entry = None
+        if input_file and not parent_version_id:
+            try:
+                entry = build_catalog(input_file).get(target_sheet_name)
+            except Exception as e:
+                print(f"⚠️ Sheet catalog unavailable, summarizing the loaded sheet: {e}")
+        sheet_catalog = describe_for_prompt(entry or summarize_sheet(df_input), instruction)
+
     # Prepare prompt
     prompt = f"""
         You are a data engineer working with climate scenario data.
@@ -87,6 +155,10 @@ def run_scenario_agent(instruction, input_file, uploaded, output_file, max_retri
         Sample rows:
         {df_input.head().to_dict(orient="records")}
 
+        Sheet catalog (values of the sheet's categorical columns, those matching the instruction first;
+        a list ending in "+N more" is cut):
+        {sheet_catalog}
+
         Instruction:
         {instruction}
 
@@ -97,6 +169,7 @@ def run_scenario_agent(instruction, input_file, uploaded, output_file, max_retri
         1. Apply any temporal filters (e.g. "after 2030") BEFORE analysis.
         2. For "most/least expensive", compute the highest/lowest MEAN value unless stated otherwise.
         3. Identify technologies or categories by name/ID — NEVER by float value matching.
+           Take names and substrings for filters from the sheet catalog where it lists them; don't invent them.
         4. Scope → aggregate → modify (in that order).
         5. Use vectorized operations only (no loops, no `.apply`).
 
@@ -123,71 +196,116 @@ def run_scenario_agent(instruction, input_file, uploaded, output_file, max_retri
 
 
 
-    def generate_code(extra_context=None):
+    def generate_code(extra_context=None, candidate=0):
         context = prompt
         if extra_context:
             context += f"\nFix the issue described here: {extra_context}"
 
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
-        response = completion.choices[0].message.content
-        return re.sub(r"^```(?:python)?|```$", "", response.strip(), flags=re.MULTILINE).strip()
-
-    # First attempt
-    code = generate_code()
-    logs.append("🧠 Model-generated code:")
-    logs.append(code)
-
-    # Safety checks
-    forbidden_patterns = [
-        r"os\.", r"sys\.", r"open\s*\(", r"subprocess",
-        r"eval\s*\(", r"exec\s*\(", r"__", r"shutil", r"pathlib"
-    ]
-    if any(re.search(p, code, re.IGNORECASE) for p in forbidden_patterns):
-        print(code)
-        raise ValueError("⚠️ Unsafe code detected! Execution blocked.")
-    
-    # Whiteliseted imports
-    #allowed_imports = ["import numpy", "import numpy as np", "import pandas", "import pandas as pd"]
-
-    import_lines = re.findall(r"^\s*import\s+[^\n]+", code, flags=re.MULTILINE)
-    for line in import_lines:
-        if not any(pkg in line for pkg in ["numpy", "pandas"]):
-            raise ValueError(f"⚠️ Unsafe import detected: '{line.strip()}' — only numpy and pandas are allowed.")
-
-    # --- Auto-inject safe imports if missing ---
-    if "import pandas" not in code:
-        logs.append("ℹ️ Auto-added: import pandas as pd")
-        code = "import pandas as pd\n" + code
-    if "import numpy" not in code:
-        logs.append("ℹ️ Auto-added: import numpy as np")
-        code = "import numpy as np\n" + code
-
-    # Try executing
-    for attempt in range(max_retries + 1):
+        # extra candidates sample at a higher temperature so a round doesn't return n copies
+        sampling = {"temperature": CANDIDATE_TEMPERATURE} if candidate else {}
+        started = time.perf_counter()
+        with span("llm.codegen", model="llama-3.3-70b-versatile", candidate=candidate) as attrs:
+            completion = client.chat.completions.create(
+                model="llama-3.3-70b-versatile",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": context
+                    }
+                ],
+                **sampling
+            )
+            record_llm_usage(attrs, completion)
+        return clean_code(completion.choices[0].message.content), (time.perf_counter() - started) * 1000
+
+    def attempt(candidate, extra_context):
+        code, gen_ms = generate_code(extra_context, candidate)
         try:
-            local_env = {"df": df_input.copy(), "pd": pd}
-            exec(code, {}, local_env)
-            df_new = local_env.get("df")
-
-            if not isinstance(df_new, pd.DataFrame):
-                raise ValueError("No valid DataFrame 'df' produced.")
+            code, df_new, notes = run_candidate(code, df_input, instruction, candidate)
+        except Exception as e:
+            raise CandidateFailed(code, e, gen_ms)
+        return code, df_new, notes, gen_ms
 
-            df_new.to_excel(output_file, index=False)
+    def success(code, df_new):
+        if output_file:
+            with span("write_output", rows=len(df_new)):
+                df_new.to_excel(output_file, index=False)
             logs.append(f"✅ Saved updated file to {output_file}")
-            return {"success": True, "code": code, "logs": "\n".join(logs)}
+        return {"success": True, "code": code, "logs": "\n".join(logs),
+                "sheet_name": target_sheet_name, "df_input": df_input, "df": df_new}
+
+    n = max(1, candidates or CODEGEN_CANDIDATES)
+    rounds = max_retries + 1 if n == 1 else min(max_retries + 1, PARALLEL_ROUNDS)
+    llm_ms = 0.0
+    code = None
+    feedback = None
+
+    # Cached code for this sheet schema and instruction skips the model
+    if CODE_CACHE:
+        with span("code_cache") as attrs:
+            cached = code_cache.lookup(target_sheet_name, df_input, instruction)
+            attrs["hit"] = cached is not None
+        if cached:
+            logs.append("♻️ Reusing cached code (LLM call skipped):")
+            logs.append(cached["code"])
+            try:
+                code, df_new, notes = run_candidate(cached["code"], df_input, instruction)
+                logs.extend(notes)
+                return success(code, df_new)
+            except Exception as e:
+                logs.append(f"❌ Error executing cached code: {e}")
+                code_cache.invalidate(cached["cache_key"])
+                feedback = f"This code:\n{cached['code']}\nfailed with: {e}"
+
+    # Each round requests n candidates concurrently and keeps the first that passes;
+    # the errors of a failed round are fed back into the next one
+    for round_no in range(rounds):
+        if round_no:
+            logs.append("🔁 Retrying with fix...")
+        errors = []
+        winner = None
+        round_gen_ms = 0.0
+        pool = ThreadPoolExecutor(max_workers=n, thread_name_prefix="codegen")
+        try:
+            with span("codegen_round", round=round_no, candidates=n) as attrs:
+                futures = [pool.submit(contextvars.copy_context().run, attempt, i, feedback) for i in range(n)]
+                for future in as_completed(futures):
+                    try:
+                        code, df_new, notes, gen_ms = future.result()
+                    except CandidateFailed as e:
+                        code = e.code
+                        round_gen_ms = max(round_gen_ms, e.gen_ms)
+                        errors.append((e.code, e.error))
+                        logs.append("🧠 Model-generated code:")
+                        logs.append(e.code)
+                        logs.append(f"❌ Error executing code: {e.error}")
+                        continue
+                    except Exception as e:
+                        errors.append((None, e))
+                        logs.append(f"❌ Code generation failed: {e}")
+                        continue
+                    winner = (code, df_new)
+                    round_gen_ms = gen_ms
+                    logs.append("🧠 Model-generated code:")
+                    logs.append(code)
+                    logs.extend(notes)
+                    break
+                attrs["passed"] = winner is not None
+                attrs["failed"] = len(errors)
+        finally:
+            # don't wait for the slower candidates once one has passed
+            pool.shutdown(wait=False, cancel_futures=True)
+        llm_ms += round_gen_ms
+
+        if winner:
+            code, df_new = winner
+            if CODE_CACHE:
+                code_cache.store(target_sheet_name, df_input, instruction, code, llm_ms)
+            return success(code, df_new)
+
+        feedback = "\n\n".join(
+            f"This code:\n{failed_code}\nfailed with: {error}" if failed_code else str(error)
+            for failed_code, error in errors[:MAX_FEEDBACK_ERRORS]
+        )
 
-        except Exception as e:
-            logs.append(f"❌ Error executing code: {e}")
-            if attempt < max_retries:
-                logs.append("🔁 Retrying with fix...")
-                code = generate_code(extra_context=str(e))
-            else:
-                return {"success": False, "code": code, "logs": "\n".join(logs)}
+    return {"success": False, "code": code, "logs": "\n".join(logs), "sheet_name": target_sheet_name}
@@ -0,0 +1,374 @@
+"""
+Headless orchestration service.
+Exposes `orchestrate` as a local HTTP/JSON API backed by a bounded job queue and
+a pool of worker processes. Workers are forked from a single-threaded fork server
+that loads the models once (copy-on-write sharing on platforms with forkserver), so
+each worker starts with the embedding model, FAISS index and metadata in place and
+never inherits locks held by the service's HTTP or collector threads.
+
+Endpoints:
+    POST /jobs                {"instruction": ..., "input_file": ..., "input_name": ...,
+                               "parent_version_id": ...}
+                              input_file: an uploaded blob (its path under the upload store, or its digest)
+                              -> 202 {"job_id", "status"}
+    GET  /jobs/<job_id>       -> job status, and the orchestrate result once done
+    GET  /jobs/<job_id>/stream -> newline-delimited JSON events until the job finishes
+    GET  /health              -> worker and queue status
+
+Backpressure: a full queue answers 503 with Retry-After; a user over the per-user
+concurrency limit gets 429. The limit applies per client address; a client that holds
+the service token (PEACH_SERVICE_TOKEN, sent as "Authorization: Bearer <token>"), such
+as the Streamlit app or an authenticating proxy, may name the user in X-Peach-User.
+
+Usage:
+    python -m backend.service [--host 127.0.0.1] [--port 8600] [--workers 4] [--queue-size 32] [--per-user 2]
+"""
+import argparse
+import hmac
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+import re
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from backend.upload_store import BLOB_DIR
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8600
+WORKERS = max(1, (os.cpu_count() or 2) - 1)
+QUEUE_SIZE = 32
+PER_USER_LIMIT = 2
+JOB_TTL = 3600          # seconds a finished job stays pollable
+ACTIVE = ("queued", "running")
+SERVICE_TOKEN = os.environ.get("PEACH_SERVICE_TOKEN")
+USER_HEADER = "X-Peach-User"
+
+
+def worker_loop(inbox, event_queue):
+    '''
+    Worker process: take the jobs the parent assigns to this worker, run orchestrate, report events.
+    '''
+    from backend.code_sandbox import enable_copy_on_write
+    from backend.orchestrator_agent import orchestrate
+
+    enable_copy_on_write()      # jobs execute generated code on copy-on-write sheets
+    while True:
+        job = inbox.get()
+        if job is None:
+            break
+        event_queue.put((job["job_id"], "running", {"pid": os.getpid()}))
+        try:
+            result = orchestrate(instruction=job["instruction"], input_file=job.get("input_file"),
+                                 input_name=job.get("input_name"), parent_version_id=job.get("parent_version_id"))
+            event_queue.put((job["job_id"], "done", {"result": result}))
+        except Exception as e:
+            event_queue.put((job["job_id"], "error", {"error": f"{type(e).__name__}: {e}"}))
+
+
+def resolve_input_file(input_file):
+    '''
+    Map a job's input_file to an uploaded blob: a blob path or a blob digest. Jobs can only
+    read workbooks from the upload store, never arbitrary server paths.
+    Output: blob path (str), or None if no input file was given. Raises ValueError otherwise.
+    '''
+    if not input_file:
+        return None
+    message = "input_file must be an uploaded workbook (blob path or digest)."
+    if not isinstance(input_file, str):
+        raise ValueError(message)
+    if re.fullmatch(r"[0-9a-f]{64}", input_file):
+        path = BLOB_DIR / f"{input_file}.xlsx"
+    else:
+        path = Path(input_file)
+    path = path.resolve()
+    if path.parent != BLOB_DIR.resolve() or not path.is_file():
+        raise ValueError(message)
+    return str(path)
+
+
+def worker_context():
+    '''
+    Multiprocessing context for workers: "forkserver" with the models preloaded in the
+    server where available, otherwise "spawn". Replacement workers are started from the
+    collector thread, so workers are never forked from this multi-threaded process.
+    '''
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(["backend.orchestrator_agent"])
+        return ctx
+    return mp.get_context("spawn")
+
+
+class JobManager:
+    '''
+    Tracks jobs in the parent process and enforces queue and per-user limits.
+    Pending jobs wait in the parent, which hands each one to an idle worker and records
+    the assignment, so the job of a worker that dies is always known.
+    '''
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, per_user=PER_USER_LIMIT):
+        ctx = worker_context()
+        self.ctx = ctx
+        self.per_user = per_user
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.queue_size = queue_size
+        self.pending = deque()      # job payloads not yet assigned to a worker
+        self.event_queue = ctx.SimpleQueue()  # unbuffered: a "running" event is sent before the job runs
+        self.restarts = 0
+        self.workers = [self._start_worker() for _ in range(workers)]
+        threading.Thread(target=self._collect_events, daemon=True).start()
+        threading.Thread(target=self._monitor_workers, daemon=True).start()
+
+    def _start_worker(self):
+        inbox = self.ctx.Queue()
+        p = self.ctx.Process(target=worker_loop, args=(inbox, self.event_queue), daemon=True)
+        p.inbox, p.job_id, p.payload = inbox, None, None
+        p.start()
+        return p
+
+    def _dispatch(self):
+        '''Assign pending jobs to idle workers. Called with the lock held.'''
+        for p in self.workers:
+            if not self.pending:
+                break
+            if p.job_id is None and p.is_alive():
+                p.payload = self.pending.popleft()
+                p.job_id = p.payload["job_id"]
+                p.inbox.put(p.payload)
+
+    def submit(self, instruction, input_file=None, user="anonymous", input_name=None, parent_version_id=None):
+        '''
+        Queue a job. Returns (http_status, payload).
+        '''
+        with self.lock:
+            self._expire()
+            active = sum(1 for j in self.jobs.values() if j["user"] == user and j["status"] in ACTIVE)
+            if active >= self.per_user:
+                return 429, {"error": f"User '{user}' already has {active} jobs in progress."}
+
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                "job_id": job_id, "user": user, "status": "queued", "submitted": time.time(),
+                "finished": None, "events": [{"status": "queued", "ts": time.time()}],
+                "result": None, "error": None,
+            }
+            if len(self.pending) >= self.queue_size:
+                return 503, {"error": "Job queue is full, retry later."}
+            self.pending.append({"job_id": job_id, "instruction": instruction, "input_file": input_file,
+                                 "input_name": input_name, "parent_version_id": parent_version_id})
+            self.jobs[job_id] = job
+            self._dispatch()
+        return 202, {"job_id": job_id, "status": "queued"}
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait_for_event(self, job_id, seen, timeout=15):
+        '''
+        Block until the job has more than `seen` events (or timeout).
+        Output: (new events, job status)
+        '''
+        with self.changed:
+            self.changed.wait_for(lambda: job_id not in self.jobs or len(self.jobs[job_id]["events"]) > seen,
+                                  timeout=timeout)
+            job = self.jobs.get(job_id)
+            if job is None:
+                return [], "expired"
+            return job["events"][seen:], job["status"]
+
+    def health(self):
+        with self.changed:
+            self._reap_workers()
+            return {
+                "workers": len(self.workers),
+                "workers_alive": sum(p.is_alive() for p in self.workers),
+                "worker_restarts": self.restarts,
+                "queued": sum(1 for j in self.jobs.values() if j["status"] == "queued"),
+                "running": sum(1 for j in self.jobs.values() if j["status"] == "running"),
+            }
+
+    def _collect_events(self):
+        while True:
+            job_id, status, data = self.event_queue.get()
+            with self.changed:
+                job = self.jobs.get(job_id)
+                if job is None or job["status"] not in ACTIVE:
+                    continue
+                job["status"] = status
+                job["events"].append({"status": status, "ts": time.time(),
+                                      **({"error": data["error"]} if "error" in data else {})})
+                if status == "done":
+                    job["result"] = data["result"]
+                if status == "error":
+                    job["error"] = data["error"]
+                if status not in ACTIVE:
+                    job["finished"] = time.time()
+                    for p in self.workers:
+                        if p.job_id == job_id:
+                            p.job_id = p.payload = None
+                    self._dispatch()
+                self.changed.notify_all()
+
+    def _monitor_workers(self, interval=1):
+        while True:
+            time.sleep(interval)
+            with self.changed:
+                self._reap_workers()
+
+    def _reap_workers(self):
+        '''
+        Replace worker processes that died (OOM kill, segfault). The job a dead worker was
+        running fails; a job assigned to it but not reported as started goes back to the front
+        of the queue once (a second death fails it, in case its "running" event was not read yet).
+        Called with the lock held.
+        '''
+        for n, p in enumerate(self.workers):
+            if p.is_alive() or p.exitcode is None:
+                continue
+            print(f"⚠️ Worker {p.pid} died (exit code {p.exitcode}); starting a replacement")
+            job = self.jobs.get(p.job_id)
+            if job and job["status"] == "queued" and not job.get("requeued"):
+                job["requeued"] = True
+                self.pending.appendleft(p.payload)
+            elif job and job["status"] in ACTIVE:
+                error = f"Worker process died (exit code {p.exitcode})"
+                job.update(status="error", error=error, finished=time.time())
+                job["events"].append({"status": "error", "ts": time.time(), "error": error})
+            self.workers[n] = self._start_worker()
+            self.restarts += 1
+        self._dispatch()
+        self.changed.notify_all()
+
+    def _expire(self):
+        now = time.time()
+        for job_id in [j for j, job in self.jobs.items() if job["finished"] and now - job["finished"] > JOB_TTL]:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        for p in self.workers:
+            p.inbox.put(None)
+        for p in self.workers:
+            p.join(timeout=5)
+
+
+def make_handler(manager):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _user(self):
+            '''
+            Who the per-user limit applies to: the X-Peach-User header for clients holding the
+            service token, otherwise the client address (never a name the caller picks freely).
+            '''
+            auth = self.headers.get("Authorization", "")
+            if SERVICE_TOKEN and self.headers.get(USER_HEADER) and \
+                    hmac.compare_digest(auth.encode(), f"Bearer {SERVICE_TOKEN}".encode()):
+                return self.headers[USER_HEADER]
+            return self.client_address[0]
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                return self._send_json(404, {"error": "Not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                instruction = body["instruction"]
+            except (ValueError, KeyError):
+                return self._send_json(400, {"error": "Body must be JSON with an 'instruction' field."})
+            try:
+                input_file = resolve_input_file(body.get("input_file"))
+            except ValueError as e:
+                return self._send_json(400, {"error": str(e)})
+
+            user = self._user()
+            status, payload = manager.submit(instruction, input_file, user, body.get("input_name"),
+                                             body.get("parent_version_id"))
+            headers = {"Retry-After": "2"} if status in (429, 503) else None
+            self._send_json(status, payload, headers)
+
+        def do_GET(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            if parts == ["health"]:
+                return self._send_json(200, manager.health())
+            if len(parts) == 2 and parts[0] == "jobs":
+                job = manager.get(parts[1])
+                if job is None:
+                    return self._send_json(404, {"error": "Unknown job"})
+                job.pop("events", None)
+                return self._send_json(200, job)
+            if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "stream":
+                return self._stream(parts[1])
+            self._send_json(404, {"error": "Not found"})
+
+        def _stream(self, job_id):
+            if manager.get(job_id) is None:
+                return self._send_json(404, {"error": "Unknown job"})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write(payload):
+                line = (json.dumps(payload, default=str) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            seen, status = 0, "queued"
+            while status in ACTIVE:
+                events, status = manager.wait_for_event(job_id, seen)
+                seen += len(events)
+                for event in events:
+                    write(event)
+            job = manager.get(job_id)
+            if job and job["status"] == "done":
+                write({"status": "result", "result": job["result"]})
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless orchestration service.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--per-user", type=int, default=PER_USER_LIMIT)
+    args = parser.parse_args()
+
+    manager = JobManager(args.workers, args.queue_size, args.per_user)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(manager))
+    print(f"✅ Orchestration service on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Client for the headless orchestration service (backend/service.py).
+Used by the Streamlit app when PEACH_SERVICE_URL is set.
+"""
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+SERVICE_URL = os.environ.get("PEACH_SERVICE_URL", "http://127.0.0.1:8600")
+SERVICE_TOKEN = os.environ.get("PEACH_SERVICE_TOKEN")     # lets the service trust the X-Peach-User header
+
+
+class ServiceBusy(RuntimeError):
+    '''
+    Raised when the service rejects a job because of backpressure (429/503).
+    '''
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _request(method, path, payload=None, base_url=None, timeout=30, headers=None):
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(f"{base_url or SERVICE_URL}{path}", data=data, method=method,
+                                 headers={"Content-Type": "application/json", **(headers or {})})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        body = json.loads(e.read() or b"{}")
+        if e.code in (429, 503):
+            raise ServiceBusy(body.get("error", "Service busy"), e.headers.get("Retry-After"))
+        raise RuntimeError(f"❌ Service error {e.code}: {body.get('error')}")
+
+
+def submit(instruction, input_file=None, user=None, base_url=None, input_name=None, parent_version_id=None):
+    '''
+    Queue an orchestrate job. Output: job_id (str)
+    '''
+    payload = {"instruction": instruction, "input_file": input_file, "input_name": input_name,
+               "parent_version_id": parent_version_id}
+    headers = {}
+    if user and SERVICE_TOKEN:
+        headers = {"Authorization": f"Bearer {SERVICE_TOKEN}", "X-Peach-User": user}
+    return _request("POST", "/jobs", payload, base_url, headers=headers)["job_id"]
+
+
+def poll(job_id, base_url=None):
+    '''
+    Current state of a job (status, result once done, error on failure).
+    '''
+    return _request("GET", f"/jobs/{job_id}", base_url=base_url)
+
+
+def stream(job_id, base_url=None, timeout=600):
+    '''
+    Yield job events (dicts) as they happen; the last event carries the result.
+    '''
+    req = urllib.request.Request(f"{base_url or SERVICE_URL}/jobs/{job_id}/stream")
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        for line in resp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def orchestrate_remote(instruction, input_file=None, input_name=None, parent_version_id=None, user=None,
+                       base_url=None, poll_interval=0.5, timeout=600):
+    '''
+    Drop-in replacement for orchestrate that runs the request on the service.
+    Output: the orchestrate result dict
+    '''
+    job_id = submit(instruction, input_file, user, base_url, input_name, parent_version_id)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = poll(job_id, base_url)
+        if job["status"] == "done":
+            return job["result"]
+        if job["status"] == "error":
+            raise RuntimeError(job["error"])
+        time.sleep(poll_interval)
+    raise TimeoutError(f"Job {job_id} did not finish within {timeout}s")
@@ -0,0 +1,180 @@
+"""
+Columnar sheet cache.
+Each workbook is identified by the SHA-256 of its content; its sheets are parsed
+from XLSX once and stored as Parquet under rag_store/sheet_cache/<hash>/, so later
+loads (and SQL queries) read columnar data instead of re-parsing the workbook.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from backend.tracing import span
+
+SHEET_CACHE_DIR = Path("rag_store/sheet_cache")
+
+# Typed loading: MESSAGEix index columns become categoricals, year columns small ints and
+# value columns float32 where that is exact (PEACH_TYPED_SHEETS=0 loads plain dtypes)
+TYPED_SHEETS = os.environ.get("PEACH_TYPED_SHEETS", "1") != "0"
+INDEX_COLUMNS = ("node", "technology", "commodity", "level", "mode", "time", "unit", "emission",
+                 "relation", "grade", "type_tec", "type_emission", "land_scenario", "land_type", "rating")
+
+_hash_memo = {}                 # (absolute path, mtime_ns, size) -> content hash
+_lock = threading.Lock()        # serializes cache writes within a process
+
+
+def file_hash(path):
+    '''
+    SHA-256 of a file's content, memoized on (absolute path, mtime, size) so unchanged
+    files are not re-read, whichever relative or absolute form of the path is passed.
+    Input: path (str or Path)
+    Output: hex digest (str)
+    '''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key in _hash_memo:
+        return _hash_memo[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    _hash_memo[key] = h.hexdigest()
+    return _hash_memo[key]
+
+
+def register_hash(path, content_hash):
+    '''
+    Record a content hash computed elsewhere (e.g. by the upload store) so the
+    file is not hashed again.
+    '''
+    stat = os.stat(path)
+    _hash_memo[(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)] = content_hash
+
+
+def workbook_dir(path, content_hash=None):
+    '''
+    Cache directory of a workbook (created on demand).
+    '''
+    directory = SHEET_CACHE_DIR / (content_hash or file_hash(path))
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def _sheet_file(sheet_name):
+    safe = re.sub(r"[^\w\-]", "_", sheet_name)[:60]
+    digest = hashlib.sha1(sheet_name.encode("utf-8")).hexdigest()[:8]
+    return f"{safe}-{digest}.parquet"
+
+
+def _write_parquet(df, target):
+    '''
+    Write a DataFrame to Parquet atomically. Object columns holding mixed types
+    (e.g. numbers and text in one Excel column) are stored as text.
+    '''
+    tmp = target.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        df.to_parquet(tmp, index=False)
+    except Exception:
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) or pd.isna(v) else str(v))
+        df.columns = [str(c) for c in df.columns]
+        df.to_parquet(tmp, index=False)
+    os.replace(tmp, target)
+
+
+def sheet_names(path, content_hash=None):
+    '''
+    Sheet names of a workbook, read from the cache manifest when available.
+    '''
+    manifest = workbook_dir(path, content_hash) / "sheets.json"
+    if manifest.exists():
+        return json.loads(manifest.read_text())
+    names = pd.ExcelFile(path).sheet_names
+    with _lock:
+        manifest.write_text(json.dumps(names))
+    return names
+
+
+def sheet_parquet_path(path, sheet_name, content_hash=None):
+    '''
+    Path of the cached Parquet file for one sheet, parsing the sheet on a cache miss.
+    Raises ValueError if the workbook has no such sheet.
+    '''
+    target = workbook_dir(path, content_hash) / _sheet_file(sheet_name)
+    if not target.exists():
+        if sheet_name not in sheet_names(path, content_hash):
+            raise ValueError(f"❌ No sheet named '{sheet_name}' found in {path}.")
+        with span("excel_parse", sheet=sheet_name):
+            df = pd.read_excel(path, sheet_name=sheet_name)
+        with _lock:
+            _write_parquet(df, target)
+    return target
+
+
+def is_index_column(column):
+    name = str(column).lower()
+    return any(name == c or name.startswith(f"{c}_") for c in INDEX_COLUMNS)
+
+
+def optimize_dtypes(df):
+    '''
+    Compact dtypes without changing any value:
+        - MESSAGEix index columns (node_loc, technology, mode, unit, time, ...) holding text -> category
+        - integer year columns (year, year_vtg, year_act, ...) -> smallest integer type that fits
+        - float value columns -> float32, only if every value survives the round trip
+    Input: df (pd.DataFrame), modified in place
+    Output: df
+    '''
+    for col in df.columns:
+        series = df[col]
+        name = str(col).lower()
+        if series.dtype == object and is_index_column(col):
+            if series.map(lambda v: isinstance(v, str) or v is None or v != v).all():
+                df[col] = series.astype("category")
+        elif name.startswith("year") and pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast="integer")
+        elif name == "value" and series.dtype == np.float64:
+            narrow = series.astype(np.float32)
+            if np.array_equal(narrow.to_numpy(np.float64), series.to_numpy(), equal_nan=True):
+                df[col] = narrow
+    return df
+
+
+def load_sheet(path, sheet_name, content_hash=None, typed=None):
+    '''
+    Load one sheet as a DataFrame from the columnar cache.
+    Inputs:
+        - path (str): path to the .xlsx workbook
+        - sheet_name (str): sheet to load
+        - content_hash (str, optional): precomputed content hash of the workbook
+        - typed (bool, optional): compact dtypes with optimize_dtypes (default TYPED_SHEETS)
+    Output: pd.DataFrame
+    '''
+    df = pd.read_parquet(sheet_parquet_path(path, sheet_name, content_hash))
+    if TYPED_SHEETS if typed is None else typed:
+        df = optimize_dtypes(df)
+    return df
+
+
+def cache_workbook(path, content_hash=None):
+    '''
+    Parse every sheet of a workbook that is not cached yet, in a single pass over the file.
+    Output: list of sheet names
+    '''
+    directory = workbook_dir(path, content_hash)
+    names = sheet_names(path, content_hash)
+    missing = [n for n in names if not (directory / _sheet_file(n)).exists()]
+    if missing:
+        with span("excel_parse", sheets=len(missing)):
+            frames = pd.read_excel(path, sheet_name=missing)
+        with _lock:
+            for name, df in frames.items():
+                _write_parquet(df, directory / _sheet_file(name))
+        print(f"✅ Cached {len(missing)} sheets of '{Path(path).name}'")
+    return names
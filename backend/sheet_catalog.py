@@ -0,0 +1,181 @@
+"""
+Per-workbook sheet catalog.
+Built once per content hash from the columnar sheet cache and stored next to it
+as rag_store/sheet_cache/<hash>/catalog.json: for every sheet its columns, dtypes,
+row count, year ranges and the distinct values of categorical columns
+(technology, node, commodity, mode, ...). Values are kept in one workbook-level
+vocabulary and referenced by position, so the catalog stays small. Sheet
+selection and prompt building read the catalog instead of the workbook.
+"""
+import json
+import os
+import re
+import threading
+
+import pandas as pd
+
+from backend.sheet_cache import cache_workbook, file_hash, load_sheet, workbook_dir
+from backend.tracing import span
+
+CATALOG_VERSION = 2
+CATEGORICAL_COLUMNS = ("technology", "node", "commodity", "mode", "level", "emission", "unit", "time")
+MAX_DISTINCT = 5000         # distinct values kept per categorical column (prompts rank and cut them)
+LOW_CARDINALITY = 50        # other text columns with at most this many values are catalogued too
+PROMPT_VALUES = 300         # values per column shown in a prompt, instruction matches first
+
+_catalogs = {}              # content hash -> decoded catalog
+_sheet_embs = {}            # content hash -> (sheet names, normalized embeddings of their descriptions)
+_lock = threading.Lock()
+
+
+def is_categorical(column, series):
+    name = str(column).lower()
+    if any(name == c or name.startswith(f"{c}_") for c in CATEGORICAL_COLUMNS):
+        return True
+    return series.dtype == object and series.nunique(dropna=True) <= LOW_CARDINALITY
+
+
+def year_range(column, series):
+    '''(min, max) of a year column (year, year_vtg, year_act, ...), else None.'''
+    if not str(column).lower().startswith("year"):
+        return None
+    years = pd.to_numeric(series, errors="coerce").dropna()
+    if years.empty:
+        return None
+    return [int(years.min()), int(years.max())]
+
+
+def summarize_sheet(df):
+    '''
+    Catalog entry of one sheet, with values in plain (decoded) form.
+    Output: dict with keys columns, dtypes, rows, years, ranges (other numeric columns),
+            values (categorical columns), distinct (number of distinct values)
+    '''
+    entry = {"columns": [str(c) for c in df.columns], "dtypes": [str(t) for t in df.dtypes],
+             "rows": int(len(df)), "years": {}, "ranges": {}, "values": {}, "distinct": {}}
+    # wide (IAMC-style) sheets carry the years as column headers
+    header_years = [int(c) for c in map(str, df.columns) if re.fullmatch(r"(19|20|21)\d\d", c)]
+    if header_years:
+        entry["years"]["<columns>"] = [min(header_years), max(header_years)]
+    for col in df.columns:
+        series = df[col]
+        years = year_range(col, series)
+        if years:
+            entry["years"][str(col)] = years
+        elif is_categorical(col, series):
+            values = sorted(series.dropna().astype(str).unique())
+            entry["distinct"][str(col)] = len(values)
+            entry["values"][str(col)] = values[:MAX_DISTINCT]
+        elif pd.api.types.is_numeric_dtype(series) and series.notna().any():
+            entry["ranges"][str(col)] = [float(series.min()), float(series.max())]
+    return entry
+
+
+def encode_catalog(sheets):
+    '''Replace value lists with positions in a shared, sorted vocabulary.'''
+    vocab = sorted({v for entry in sheets.values() for values in entry["values"].values() for v in values})
+    position = {v: i for i, v in enumerate(vocab)}
+    encoded = {}
+    for name, entry in sheets.items():
+        encoded[name] = dict(entry, values={col: [position[v] for v in values]
+                                            for col, values in entry["values"].items()})
+    return {"version": CATALOG_VERSION, "vocab": vocab, "sheets": encoded}
+
+
+def decode_catalog(data):
+    vocab = data["vocab"]
+    return {name: dict(entry, values={col: [vocab[i] for i in ids] for col, ids in entry["values"].items()})
+            for name, entry in data["sheets"].items()}
+
+
+def build_catalog(path, content_hash=None):
+    '''
+    Build (or load) the catalog of a workbook; parses missing sheets into the sheet cache first.
+    Inputs:
+        - path (str): path to the .xlsx workbook
+        - content_hash (str, optional): precomputed content hash of the workbook
+    Output: dict sheet name -> catalog entry (decoded)
+    '''
+    content_hash = content_hash or file_hash(path)
+    if content_hash in _catalogs:
+        return _catalogs[content_hash]
+
+    target = workbook_dir(path, content_hash) / "catalog.json"
+    if target.exists():
+        data = json.loads(target.read_text(encoding="utf-8"))
+        if data.get("version") == CATALOG_VERSION:
+            _catalogs[content_hash] = decode_catalog(data)
+            return _catalogs[content_hash]
+
+    with span("catalog_build"):
+        names = cache_workbook(path, content_hash)
+        sheets = {name: summarize_sheet(load_sheet(path, name, content_hash)) for name in names}
+    with _lock:
+        tmp = target.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(encode_catalog(sheets), ensure_ascii=False, separators=(",", ":")),
+                       encoding="utf-8")
+        os.replace(tmp, target)
+    _catalogs[content_hash] = sheets
+    return sheets
+
+
+def catalog_if_ready(path, content_hash=None):
+    '''
+    The workbook's catalog if it is already built (in memory or on disk), else None; never parses sheets.
+    '''
+    content_hash = content_hash or file_hash(path)
+    if content_hash in _catalogs:
+        return _catalogs[content_hash]
+    target = workbook_dir(path, content_hash) / "catalog.json"
+    if target.exists():
+        return build_catalog(path, content_hash)
+    return None
+
+
+def sheet_description(name, entry, max_columns=12):
+    '''One-line text of a sheet (name, columns, a few values) used to embed it for sheet selection.'''
+    parts = [name, "columns: " + ", ".join(entry["columns"][:max_columns])]
+    for col, values in entry["values"].items():
+        parts.append(f"{col}: " + ", ".join(values[:8]))
+    return "; ".join(parts)
+
+
+def sheet_embeddings(path, model, content_hash=None):
+    '''
+    Embeddings of every sheet's description, computed once per workbook content.
+    Output: (sheet names, normalized embeddings as np.ndarray)
+    '''
+    content_hash = content_hash or file_hash(path)
+    if content_hash not in _sheet_embs:
+        catalog = build_catalog(path, content_hash)
+        names = list(catalog)
+        embs = model.encode([sheet_description(n, catalog[n]) for n in names],
+                            convert_to_numpy=True, normalize_embeddings=True)
+        _sheet_embs[content_hash] = (names, embs)
+    return _sheet_embs[content_hash]
+
+
+def matches_instruction(value, words):
+    '''True if a catalog value, or one of its parts ("solar" in "solar_pv_ppl"), is a word of the instruction.'''
+    value = value.lower()
+    return value in words or any(part in words for part in re.split(r"[^a-z0-9]+", value))
+
+
+def describe_for_prompt(entry, instruction=None, max_values=PROMPT_VALUES):
+    '''
+    Schema and value vocabularies of a sheet, as text for the code-generation prompt.
+    Values that match a word of the instruction are listed first, so a cut list keeps them.
+    '''
+    words = set(re.findall(r"[a-z0-9_]+", instruction.lower())) if instruction else set()
+    lines = [f"Rows: {entry['rows']}",
+             "Columns (dtype): " + ", ".join(f"{c} ({t})" for c, t in zip(entry["columns"], entry["dtypes"]))]
+    for col, (lo, hi) in entry["years"].items():
+        label = "year columns" if col == "<columns>" else col
+        lines.append(f"{label}: {lo} .. {hi}")
+    for col, values in entry["values"].items():
+        if words:
+            values = sorted(values, key=lambda v: not matches_instruction(v, words))
+        shown = values[:max_values]
+        more = entry["distinct"].get(col, len(values)) - len(shown)
+        lines.append(f"{col} values: " + ", ".join(shown) + (f", ... (+{more} more)" if more > 0 else ""))
+    return "\n".join(lines)
@@ -0,0 +1,252 @@
+"""
+Structured query path for data questions.
+Aggregation questions ("which technology is historically the cheapest?") are
+answered by an LLM-written DuckDB query over the cached columnar sheets of the
+scenario workbook; only the small result table is handed to the generator.
+"""
+import os
+import re
+from pathlib import Path
+
+import duckdb
+import numpy as np
+from groq import Groq
+
+from backend.sheet_cache import file_hash, load_sheet, sheet_names
+from backend.sheet_catalog import build_catalog, catalog_if_ready, sheet_embeddings
+from backend.upload_store import start_preparse
+from backend.tracing import span, record_llm_usage
+
+groq_api_key = os.environ.get("GROQ_API_KEY1")
+client = Groq(api_key = groq_api_key)
+
+MAX_RESULT_ROWS = 50
+MAX_CANDIDATE_SHEETS = 4
+
+data_question_terms = [
+    "cheapest", "most expensive", "expensive", "highest", "lowest", "maximum", "minimum", "max", "min",
+    "average", "mean", "median", "total", "sum of", "how many", "how much", "count", "number of",
+    "top", "rank", "largest", "smallest", "compare", "trend", "distinct", "list all", "per year", "by year"
+]
+data_question_pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in data_question_terms) + r")\b")
+# column names too common in documentation questions to mark a question as being about the data
+generic_terms = {"value", "unit", "mode", "time", "level", "year", "type", "name"}
+forbidden_sql = re.compile(
+    r"\b(insert|update|delete|create|drop|alter|attach|detach|copy|pragma|install|load|export|import|call|set|"
+    r"read_csv\w*|read_parquet|read_json\w*|read_text|read_blob|glob)\b",
+    re.IGNORECASE,
+)
+
+
+_vocabularies = {}      # content hash -> terms naming the workbook's sheets, columns and values
+
+
+def workbook_vocabulary(workbook):
+    '''
+    Lowercase terms that refer to a workbook's data: sheet names, column names and
+    categorical values from its catalog, plus the parts of underscore-joined values
+    (so "solar" matches "solar_pv").
+    Output: set of terms, or None while the catalog is still being built in the background
+    '''
+    content_hash = file_hash(workbook)
+    if content_hash not in _vocabularies:
+        catalog = catalog_if_ready(workbook, content_hash)
+        if catalog is None:
+            start_preparse(Path(workbook), content_hash)
+            return None
+        terms = set()
+        for name, entry in catalog.items():
+            terms.add(name.lower())
+            terms.update(c.lower() for c in entry["columns"])
+            for values in entry["values"].values():
+                for value in values:
+                    value = value.lower()
+                    terms.add(value)
+                    terms.update(part for part in value.split("_") if len(part) >= 4)
+        _vocabularies[content_hash] = terms - generic_terms
+    return _vocabularies[content_hash]
+
+
+def is_data_question(query, workbook):
+    '''
+    Rule-based check for questions that need aggregation over scenario data: an
+    aggregation term (whole word) and a sheet, column or value of the workbook. Until the
+    workbook's catalog is ready (built in the background) questions take the document path.
+    '''
+    text = query.lower()
+    if not data_question_pattern.search(text):
+        return False
+    try:
+        vocabulary = workbook_vocabulary(workbook)
+    except Exception as e:
+        print(f"[Table Query Warning] Workbook vocabulary unavailable: {e}")
+        return False
+    if vocabulary is None:
+        print("[Table Query] Workbook catalog is still being built; answering from documents.")
+        return False
+    # the aggregation term itself doesn't count ("total" is also a commodity name)
+    return any(word in vocabulary for word in re.findall(r"\w+", data_question_pattern.sub(" ", text)))
+
+
+def candidate_sheets(query, workbook, model, k=MAX_CANDIDATE_SHEETS):
+    '''
+    Pick the sheets most likely to answer a query: sheets named in the query first,
+    then sheets whose catalog descriptions (name, columns, values) are semantically closest to the query.
+    Inputs:
+        - query (str): user question
+        - workbook (str): path to the .xlsx workbook
+        - model: sentence-transformers embedding model
+        - k (int): number of sheets to return
+    Output: list of sheet names
+    '''
+    content_hash = file_hash(workbook)
+    names = sheet_names(workbook, content_hash)
+    text = query.lower()
+    mentioned = sorted((n for n in names if re.search(rf"\b{re.escape(n.lower())}\b", text)), key=len, reverse=True)
+
+    names, embs = sheet_embeddings(workbook, model, content_hash)
+    q_emb = model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+    ranked = [names[i] for i in np.argsort(-(embs @ q_emb[0]))]
+
+    sheets = []
+    for name in mentioned + ranked:
+        if name not in sheets:
+            sheets.append(name)
+        if len(sheets) == k:
+            break
+    return sheets
+
+
+def describe_sheet(name, entry, max_values=12):
+    '''
+    Compact schema description of a sheet for the SQL prompt, from its catalog entry:
+    columns with dtypes, row count, value ranges and a few distinct values of text columns.
+    '''
+    lines = [f'Table "{name}" ({entry["rows"]} rows):']
+    for col, dtype in zip(entry["columns"], entry["dtypes"]):
+        if col in entry["values"]:
+            values = entry["values"][col]
+            more = entry["distinct"].get(col, len(values)) > max_values
+            lines.append(f"  - {col} (text): {', '.join(values[:max_values])}{', ...' if more else ''}")
+        elif col in entry["years"] or col in entry["ranges"]:
+            lo, hi = entry["years"].get(col) or entry["ranges"][col]
+            lines.append(f"  - {col} ({dtype}): {lo} .. {hi}")
+        else:
+            lines.append(f"  - {col} ({dtype})")
+    return "\n".join(lines)
+
+
+def validate_sql(sql):
+    '''
+    Allow only a single read-only SELECT/WITH statement without file access.
+    Raises ValueError otherwise.
+    '''
+    statement = sql.strip().rstrip(";").strip()
+    if ";" in statement:
+        raise ValueError("⚠️ Multiple SQL statements are not allowed.")
+    if not re.match(r"^(select|with)\b", statement, re.IGNORECASE):
+        raise ValueError("⚠️ Only SELECT queries are allowed.")
+    # keywords inside string literals / quoted identifiers (e.g. '%export%') are data, not SQL
+    unquoted = re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", "''", statement)
+    if forbidden_sql.search(unquoted):
+        raise ValueError("⚠️ Unsafe SQL detected! Execution blocked.")
+    return statement
+
+
+def generate_sql(query, schemas):
+    '''
+    Ask the LLM for a DuckDB query that answers the question over the given tables.
+    '''
+    prompt = f"""
+        You are a data analyst working with MESSAGEix climate scenario data stored in DuckDB tables.
+
+        Tables:
+        {chr(10).join(schemas)}
+
+        Question:
+        {query}
+
+        TASK:
+        Write ONE DuckDB SQL SELECT query that answers the question exactly.
+
+        RULES:
+        1. Quote table names with double quotes, e.g. SELECT * FROM "inv_cost".
+        2. Use GROUP BY / aggregates (AVG, MIN, MAX, SUM, COUNT) for comparisons; for
+           "cheapest/most expensive" compare the MEAN value per category unless stated otherwise.
+        3. Apply temporal filters (e.g. "after 2030", "historically") on the year columns.
+        4. Match names with ILIKE '%...%', never exact float values.
+        5. Return at most {MAX_RESULT_ROWS} rows, ordered so the answer comes first.
+
+        OUTPUT:
+        - Return ONLY the SQL query
+        - No explanations
+        - No markdown
+    """
+    with span("llm.sql", model="llama-3.3-70b-versatile") as attrs:
+        completion = client.chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        )
+        record_llm_usage(attrs, completion)
+    response = completion.choices[0].message.content
+    return re.sub(r"^```(?:sql)?|```$", "", response.strip(), flags=re.MULTILINE).strip()
+
+
+def run_sql(sql, tables):
+    '''
+    Run a validated query against in-memory tables with file access disabled.
+    Inputs:
+        - sql (str): SELECT statement
+        - tables (dict): table name -> pd.DataFrame
+    Output: pd.DataFrame with at most MAX_RESULT_ROWS rows
+    '''
+    statement = validate_sql(sql)
+    con = duckdb.connect(database=":memory:")
+    try:
+        with span("sql") as attrs:
+            for name, df in tables.items():
+                con.register(name, df)
+            con.execute("SET enable_external_access = false")
+            con.execute("SET lock_configuration = true")
+            result = con.execute(f"SELECT * FROM ({statement}) AS q LIMIT {MAX_RESULT_ROWS}").fetch_df()
+            attrs["rows"] = len(result)
+        return result
+    finally:
+        con.close()
+
+
+def query_table(query, workbook, model):
+    '''
+    Answer a data question with a structured query over the workbook's cached sheets.
+    Inputs:
+        - query (str): user question
+        - workbook (str): path to the .xlsx workbook
+        - model: sentence-transformers embedding model (for sheet selection)
+    Output:
+        dict with keys sql (str), sheets (list), result (pd.DataFrame), or None if the
+        query could not be answered this way (caller falls back to document RAG)
+    '''
+    try:
+        content_hash = file_hash(workbook)
+        with span("sheet_select"):
+            sheets = candidate_sheets(query, workbook, model)
+        with span("sheet_load", sheets=len(sheets)):
+            tables = {name: load_sheet(workbook, name, content_hash) for name in sheets}
+        catalog = build_catalog(workbook, content_hash)
+        schemas = [describe_sheet(name, catalog[name]) for name in tables]
+        sql = generate_sql(query, schemas)
+        result = run_sql(sql, tables)
+    except Exception as e:
+        print(f"[Table Query Warning] Structured query failed: {e}")
+        return None
+
+    if result.empty:
+        print("[Table Query Warning] Query returned no rows.")
+        return None
+    print(f"Structured query over {sheets}: {len(result)} rows")
+    return {"sql": sql, "sheets": sheets, "result": result}
@@ -0,0 +1,262 @@
+"""
+Per-stage tracing for orchestrate.
+A trace covers one user request; spans inside it time individual stages
+(routing, LLM calls, encoding, FAISS search, Excel parsing, code execution,
+output writing, DB writes). Spans are buffered in memory and written in one
+batch to the `trace_spans` table of the conversation history database when the
+trace ends, and appended to a JSONL file if PEACH_TRACE_FILE is set.
+
+Summary CLI:
+    python -m backend.tracing --since 2025-12-01 --until 2025-12-31
+    python -m backend.tracing --since 24h --file traces.jsonl
+"""
+import argparse
+import contextvars
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from backend import conv_history
+
+TRACE_FILE = os.environ.get("PEACH_TRACE_FILE")
+
+_current_trace = contextvars.ContextVar("peach_trace", default=None)
+_current_span = contextvars.ContextVar("peach_span", default=None)
+
+
+def init_trace_table():
+    '''
+    Create the trace_spans table if it doesn't exist.
+    Output: None
+    '''
+    try:
+        with sqlite3.connect(conv_history.DB_PATH) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trace_spans (
+                    trace_id TEXT,
+                    span_id TEXT,
+                    parent_id TEXT,
+                    conv_id TEXT,
+                    stage TEXT,
+                    start_ts REAL,
+                    duration_ms REAL,
+                    tokens_in INTEGER,
+                    tokens_out INTEGER,
+                    attrs TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_trace_spans_start ON trace_spans (start_ts)")
+    except Exception as e:
+        print("❌ Error initializing trace table:", e)
+
+
+@contextmanager
+def trace(conv_id=None):
+    '''
+    Open a trace for one request. Spans opened inside the block (also in code called
+    from it) are collected and flushed when the block exits, even on errors.
+    Input: conv_id (str, optional) - conversation the request belongs to
+    Output: trace dict with keys trace_id, conv_id, spans
+    '''
+    current = {"trace_id": uuid.uuid4().hex[:16], "conv_id": conv_id, "spans": []}
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        flush_trace(current)
+
+
+@contextmanager
+def span(stage, **attrs):
+    '''
+    Time one stage of the active trace. Outside a trace this is a no-op timer.
+    The yielded dict can be filled with extra attributes, e.g. tokens_in/tokens_out.
+    Inputs:
+        - stage (str): stage name, e.g. "routing", "llm.codegen", "faiss"
+        - attrs: extra attributes stored with the span
+    '''
+    current = _current_trace.get()
+    record = {
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": _current_span.get(),
+        "stage": stage,
+        "start_ts": time.time(),
+        "attrs": dict(attrs),
+    }
+    token = _current_span.set(record["span_id"])
+    start = time.perf_counter()
+    try:
+        yield record["attrs"]
+    except Exception as e:
+        record["attrs"]["error"] = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        record["duration_ms"] = (time.perf_counter() - start) * 1000
+        _current_span.reset(token)
+        if current is not None:
+            current["spans"].append(record)
+
+
+def record_llm_usage(attrs, completion):
+    '''
+    Copy token usage from a chat completion into span attributes.
+    '''
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        attrs["tokens_in"] = getattr(usage, "prompt_tokens", None)
+        attrs["tokens_out"] = getattr(usage, "completion_tokens", None)
+
+
+def stage_breakdown(current):
+    '''
+    Per-stage summary of a finished (or running) trace, in start order.
+    Output: list of dicts with stage, duration_ms, tokens_in, tokens_out
+    '''
+    rows = []
+    for s in sorted(current["spans"], key=lambda s: s["start_ts"]):
+        rows.append({
+            "stage": s["stage"],
+            "duration_ms": round(s["duration_ms"], 1),
+            "tokens_in": s["attrs"].get("tokens_in"),
+            "tokens_out": s["attrs"].get("tokens_out"),
+        })
+    return rows
+
+
+def flush_trace(current):
+    '''
+    Write a trace's spans to the history database (and the JSONL trace file, if set).
+    Tracing failures are reported but never break the request.
+    '''
+    if not current["spans"]:
+        return
+    rows = [(
+        current["trace_id"], s["span_id"], s["parent_id"], current["conv_id"], s["stage"], s["start_ts"],
+        s["duration_ms"], s["attrs"].get("tokens_in"), s["attrs"].get("tokens_out"),
+        json.dumps({k: v for k, v in s["attrs"].items() if k not in ("tokens_in", "tokens_out")}, default=str),
+    ) for s in current["spans"]]
+
+    try:
+        with sqlite3.connect(conv_history.DB_PATH, timeout=10) as conn:
+            conn.executemany("""
+                INSERT INTO trace_spans
+                (trace_id, span_id, parent_id, conv_id, stage, start_ts, duration_ms, tokens_in, tokens_out, attrs)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+    except Exception as e:
+        print(f"⚠️ Could not write trace to database: {e}")
+
+    if TRACE_FILE:
+        try:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(
+                        ["trace_id", "span_id", "parent_id", "conv_id", "stage", "start_ts",
+                         "duration_ms", "tokens_in", "tokens_out", "attrs"], row))) + "\n")
+        except Exception as e:
+            print(f"⚠️ Could not write trace file: {e}")
+
+
+def percentile(values, q):
+    '''
+    Linear-interpolated percentile of a list of numbers (q in 0..100).
+    '''
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    pos = (len(ordered) - 1) * q / 100
+    lo, hi = int(pos), min(int(pos) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def load_spans(since=None, until=None, trace_file=None):
+    '''
+    Load (stage, duration_ms, tokens_in, tokens_out) rows from the database or a JSONL trace file.
+    Inputs: since/until (float): epoch seconds bounds, trace_file (str, optional)
+    '''
+    since = since if since is not None else 0
+    until = until if until is not None else time.time() + 1
+    if trace_file:
+        rows = []
+        with open(trace_file, encoding="utf-8") as f:
+            for line in f:
+                s = json.loads(line)
+                if since <= s["start_ts"] <= until:
+                    rows.append((s["stage"], s["duration_ms"], s["tokens_in"], s["tokens_out"]))
+        return rows
+    with sqlite3.connect(conv_history.DB_PATH) as conn:
+        return conn.execute("""
+            SELECT stage, duration_ms, tokens_in, tokens_out FROM trace_spans
+            WHERE start_ts BETWEEN ? AND ?
+        """, (since, until)).fetchall()
+
+
+def summarize(rows):
+    '''
+    p50/p95/p99 latency and mean tokens per stage.
+    Output: list of dicts sorted by stage name
+    '''
+    by_stage = {}
+    for stage, duration, tokens_in, tokens_out in rows:
+        entry = by_stage.setdefault(stage, {"durations": [], "tokens_in": [], "tokens_out": []})
+        entry["durations"].append(duration)
+        if tokens_in is not None:
+            entry["tokens_in"].append(tokens_in)
+        if tokens_out is not None:
+            entry["tokens_out"].append(tokens_out)
+
+    summary = []
+    for stage, entry in sorted(by_stage.items()):
+        d = entry["durations"]
+        summary.append({
+            "stage": stage,
+            "count": len(d),
+            "p50_ms": percentile(d, 50),
+            "p95_ms": percentile(d, 95),
+            "p99_ms": percentile(d, 99),
+            "mean_tokens_in": sum(entry["tokens_in"]) / len(entry["tokens_in"]) if entry["tokens_in"] else None,
+            "mean_tokens_out": sum(entry["tokens_out"]) / len(entry["tokens_out"]) if entry["tokens_out"] else None,
+        })
+    return summary
+
+
+def parse_time(value):
+    '''
+    Parse an ISO date/time or a relative duration ("30m", "24h", "7d") into epoch seconds.
+    '''
+    if value is None:
+        return None
+    units = {"m": "minutes", "h": "hours", "d": "days"}
+    if value[-1:] in units and value[:-1].isdigit():
+        return (datetime.now() - timedelta(**{units[value[-1]]: int(value[:-1])})).timestamp()
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles from recorded traces.")
+    parser.add_argument("--since", help="ISO date/time or relative duration (e.g. 24h, 7d)")
+    parser.add_argument("--until", help="ISO date/time or relative duration")
+    parser.add_argument("--file", help="read spans from a JSONL trace file instead of the database")
+    args = parser.parse_args()
+
+    rows = load_spans(parse_time(args.since), parse_time(args.until), args.file)
+    if not rows:
+        print("No spans recorded in this time range.")
+        return
+
+    def fmt(v):
+        return f"{v:>9.1f}" if v is not None else f"{'-':>9}"
+
+    print(f"{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'tok in':>10}{'tok out':>10}")
+    for s in summarize(rows):
+        print(f"{s['stage']:<22}{s['count']:>7} {fmt(s['p50_ms'])} {fmt(s['p95_ms'])} {fmt(s['p99_ms'])} "
+              f"{fmt(s['mean_tokens_in'])} {fmt(s['mean_tokens_out'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Content-addressed upload store.
+Uploaded workbooks are stored once under data/history/uploads/blobs/<sha256>.xlsx,
+whatever name they were uploaded under, and each session keeps its own
+name -> hash mapping. A new blob is pre-parsed into the columnar sheet cache (and
+its sheet catalog built) on a background thread as soon as it arrives, so the
+first request on it finds its sheets ready.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from backend.sheet_cache import register_hash
+from backend.sheet_catalog import build_catalog
+
+UPLOAD_DIR = Path("data/history/uploads")
+BLOB_DIR = UPLOAD_DIR / "blobs"
+
+_preparse_threads = {}      # content hash -> pre-parse thread (one per blob per process)
+_preparse_lock = threading.Lock()
+
+
+def content_hash(data):
+    '''
+    SHA-256 hex digest of bytes-like data.
+    '''
+    return hashlib.sha256(data).hexdigest()
+
+
+def put_blob(data, suffix=".xlsx"):
+    '''
+    Write data under its content hash unless an identical blob already exists.
+    Inputs:
+        - data (bytes or memoryview): file content
+        - suffix (str): file extension of the blob
+    Outputs:
+        - digest (str): content hash
+        - path (Path): blob path
+        - created (bool): whether the blob was written by this call
+    '''
+    digest = content_hash(data)
+    path = BLOB_DIR / f"{digest}{suffix}"
+    if path.exists():
+        return digest, path, False
+
+    BLOB_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return digest, path, True
+
+
+def start_preparse(path, digest):
+    '''
+    Parse all sheets of a blob into the sheet cache and build its catalog on a background thread.
+    Output: the pre-parse thread (already started or finished)
+    '''
+    with _preparse_lock:
+        thread = _preparse_threads.get(digest)
+        if thread is None:
+            def run():
+                try:
+                    build_catalog(str(path), content_hash=digest)
+                except Exception as e:
+                    print(f"⚠️ Background pre-parse failed for {path.name}: {e}")
+
+            thread = threading.Thread(target=run, name=f"preparse-{digest[:8]}", daemon=True)
+            _preparse_threads[digest] = thread
+            thread.start()
+    return thread
+
+
+def store_upload(uploaded_file, session_uploads):
+    '''
+    Store a Streamlit upload and return the path of its blob.
+    A rerun with the same upload (same name, size and file_id) is answered from the
+    session mapping without hashing or writing anything.
+
+    Inputs:
+        - uploaded_file: Streamlit UploadedFile
+        - session_uploads (dict): per-session state, {"files": {key: hash}, "names": {name: hash}}
+    Outputs:
+        - path (str): blob path to pass to orchestrate
+        - digest (str): content hash
+        - is_new (bool): whether this session saw the upload for the first time
+    '''
+    suffix = Path(uploaded_file.name).suffix or ".xlsx"
+    key = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, "file_id", None))
+    digest = session_uploads.setdefault("files", {}).get(key)
+    if digest is not None:
+        return str(BLOB_DIR / f"{digest}{suffix}"), digest, False
+
+    digest, path, created = put_blob(uploaded_file.getbuffer(), suffix)
+    session_uploads["files"][key] = digest
+    session_uploads.setdefault("names", {})[uploaded_file.name] = digest
+    register_hash(path, digest)
+    start_preparse(path, digest)
+    print(f"{'💾 Stored' if created else '♻️ Reused'} upload '{uploaded_file.name}' as blob {digest[:12]}")
+    return str(path), digest, True
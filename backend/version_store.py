@@ -0,0 +1,473 @@
+"""
+Delta-based scenario version store.
+Each scenario edit is stored as a cell-level delta of the edited sheet against
+its parent version (or the base workbook for the first edit), in the
+`scenario_versions` table of the conversation history database. A version is
+rebuilt lazily by replaying the deltas of its lineage over the cached base
+sheet, so storage grows with the size of the edits, not of the workbook.
+Deltas are stored as data only: a JSON header (column names, dtypes, the columns
+of the changed cells) followed by Arrow IPC tables for the changed rows and values,
+so they load across pandas versions and never execute code.
+"""
+import json
+import os
+import sqlite3
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from backend import conv_history
+from backend.sheet_cache import file_hash, load_sheet
+from backend.tracing import span
+
+MATERIALIZED_CACHE_SIZE = 8
+DELTA_MAGIC = b"PEACHDELTA1\n"
+
+_materialized = OrderedDict()       # (version_id, sheet_name) -> DataFrame, LRU
+_cache_lock = threading.Lock()
+
+
+def init_version_table():
+    '''
+    Create the scenario_versions table if it doesn't exist.
+    Output: None
+    '''
+    try:
+        with sqlite3.connect(conv_history.DB_PATH) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scenario_versions (
+                    version_id TEXT PRIMARY KEY,
+                    parent_id TEXT,
+                    base_path TEXT NOT NULL,
+                    base_hash TEXT NOT NULL,
+                    sheet_name TEXT NOT NULL,
+                    delta BLOB NOT NULL,
+                    delta_size INTEGER,
+                    cells_changed INTEGER,
+                    rows_added INTEGER,
+                    rows_removed INTEGER,
+                    created TEXT
+                )
+            """)
+    except Exception as e:
+        print("❌ Error initializing version table:", e)
+
+
+# ---------- vectorized diff / patch ----------
+
+def compute_delta(df_old, df_new):
+    '''
+    Cell-level difference between two versions of a sheet, aligned on the row index.
+    Inputs:
+        - df_old (pd.DataFrame): parent version
+        - df_new (pd.DataFrame): edited version
+    Output:
+        delta (dict) with keys
+            - removed_rows: index labels dropped from df_old
+            - added_rows: DataFrame of rows only in df_new
+            - cells: (row labels, column names, new values) of modified cells
+            - removed_cols / added_cols: dropped column names / DataFrame of new columns
+            - columns, dtypes, order: final column order, dtypes, and row order if it changed
+        or {"replace": df_new} when either index has duplicate labels and rows cannot be aligned
+    '''
+    if not (df_old.index.is_unique and df_new.index.is_unique):
+        return {"replace": df_new}
+
+    common_cols = [c for c in df_new.columns if c in df_old.columns]
+    removed_cols = [c for c in df_old.columns if c not in df_new.columns]
+    added_col_names = [c for c in df_new.columns if c not in df_old.columns]
+
+    removed_rows = df_old.index.difference(df_new.index, sort=False)
+    added_rows = df_new.index.difference(df_old.index, sort=False)
+    common_rows = df_new.index.intersection(df_old.index, sort=False)
+
+    old = df_old.loc[common_rows, common_cols]
+    new = df_new.loc[common_rows, common_cols]
+    old_vals = old.to_numpy(dtype=object)
+    new_vals = new.to_numpy(dtype=object)
+    both_na = pd.isna(old_vals) & pd.isna(new_vals)
+    changed = (old_vals != new_vals) & ~both_na
+    r, c = np.nonzero(changed)
+
+    expected = df_old.index.drop(removed_rows).append(added_rows)
+    return {
+        "removed_rows": removed_rows,
+        "added_rows": df_new.loc[added_rows],
+        "cells": (common_rows[r], np.asarray(common_cols, dtype=object)[c], new_vals[r, c]),
+        "removed_cols": removed_cols,
+        "added_cols": df_new.loc[common_rows, added_col_names],
+        "columns": list(df_new.columns),
+        "dtypes": {col: str(dtype) for col, dtype in df_new.dtypes.items()},
+        "order": None if expected.equals(df_new.index) else df_new.index,
+    }
+
+
+def apply_delta(df_old, delta):
+    '''
+    Rebuild the edited sheet from its parent and a delta produced by compute_delta.
+    Output: new DataFrame (df_old is not modified)
+    '''
+    if "replace" in delta:
+        return delta["replace"].copy()
+    df = df_old.drop(index=delta["removed_rows"], columns=delta["removed_cols"])
+
+    rows, cols, values = delta["cells"]
+    for col in pd.unique(cols):
+        mask = cols == col
+        # patch as object so new values never clash with the old dtype; dtypes are restored below
+        if df[col].dtype != object:
+            df[col] = df[col].astype(object)
+        df.loc[rows[mask], col] = values[mask]
+
+    if len(delta["added_cols"].columns):
+        df = df.join(delta["added_cols"])
+    if len(delta["added_rows"]):
+        df = pd.concat([df, delta["added_rows"]])
+    if delta["order"] is not None:
+        df = df.loc[delta["order"]]
+    df = df[delta["columns"]]
+
+    for col, dtype in delta["dtypes"].items():
+        if str(df[col].dtype) != dtype:
+            try:
+                df[col] = df[col].astype(dtype)
+            except (TypeError, ValueError):
+                pass
+    return df
+
+
+def delta_stats(delta):
+    if "replace" in delta:
+        return {"cells_changed": delta["replace"].size, "rows_added": len(delta["replace"]), "rows_removed": 0}
+    return {
+        "cells_changed": len(delta["cells"][0]) + delta["added_cols"].size,
+        "rows_added": len(delta["added_rows"]),
+        "rows_removed": len(delta["removed_rows"]),
+    }
+
+
+# ---------- serialization ----------
+
+def _frame_bytes(frame):
+    '''
+    Arrow IPC bytes (zstd) of a DataFrame with its index; columns are stored by position
+    (Arrow needs string names) and restored from the header. Object columns holding mixed
+    types are stored as text, as in the sheet cache.
+    '''
+    frame = frame.copy()
+    frame.columns = [str(i) for i in range(frame.shape[1])]
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        for col in frame.columns[frame.dtypes == object]:
+            frame[col] = frame[col].map(lambda v: v if v is None or isinstance(v, str) or pd.isna(v) else str(v))
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _read_frame(data, columns):
+    frame = pa.ipc.open_stream(data).read_all().to_pandas()
+    frame.columns = pd.Index(columns, dtype=object)
+    return frame
+
+
+def encode_delta(delta):
+    '''
+    Serialize a delta from compute_delta without pickle.
+    Layout: DELTA_MAGIC, 4-byte header length, JSON header, then the Arrow IPC parts
+    (changed rows, added columns, removed/ordered row labels and the changed cells);
+    empty parts are left out.
+    Output: bytes
+    '''
+    parts, header = {}, {"parts": {}}
+    if "replace" in delta:
+        parts["replace"] = _frame_bytes(delta["replace"])
+        header["replace_columns"] = list(delta["replace"].columns)
+    else:
+        rows, cols, values = delta["cells"]
+        cell_columns = list(pd.unique(cols))
+        # changed cells as one wide table: a value and a "changed" flag per edited column
+        cell_rows = pd.Index(pd.unique(rows))
+        cells = {}
+        for j, col in enumerate(cell_columns):
+            mask = cols == col
+            # unchanged positions repeat a changed value, so each column keeps one type
+            series = pd.Series(values[mask], index=rows[mask], dtype=object)
+            cells[f"v{j}"] = series.reindex(cell_rows, fill_value=values[mask][0]).infer_objects()
+            cells[f"m{j}"] = pd.Series(True, index=rows[mask]).reindex(cell_rows, fill_value=False)
+        cells = pd.DataFrame(cells, index=cell_rows)
+        header.update({
+            "columns": list(delta["columns"]),
+            "dtypes": [delta["dtypes"][c] for c in delta["columns"]],
+            "removed_cols": list(delta["removed_cols"]),
+            "added_cols": list(delta["added_cols"].columns),
+            "added_rows_columns": list(delta["added_rows"].columns),
+            "cell_columns": cell_columns,
+            "has_order": delta["order"] is not None,
+        })
+        parts["cells"] = _frame_bytes(cells) if len(cells) else None
+        parts["removed_rows"] = _frame_bytes(pd.DataFrame(index=delta["removed_rows"])) if len(delta["removed_rows"]) else None
+        parts["added_rows"] = _frame_bytes(delta["added_rows"]) if len(delta["added_rows"]) else None
+        parts["added_cols"] = _frame_bytes(delta["added_cols"]) if len(delta["added_cols"].columns) else None
+        if delta["order"] is not None:
+            parts["order"] = _frame_bytes(pd.DataFrame(index=delta["order"]))
+
+    body, offset = [], 0
+    for name, data in parts.items():
+        if data is None:
+            continue
+        header["parts"][name] = [offset, len(data)]
+        body.append(data)
+        offset += len(data)
+    head = json.dumps(header, default=_json_default).encode("utf-8")
+    return DELTA_MAGIC + struct.pack(">I", len(head)) + head + b"".join(body)
+
+
+def _json_default(value):
+    # numpy scalars among column names
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Column name {value!r} can't be stored in a version delta")
+
+
+def decode_delta(blob):
+    '''
+    Inverse of encode_delta. Output: delta dict as produced by compute_delta
+    '''
+    blob = bytes(blob)
+    if not blob.startswith(DELTA_MAGIC):
+        raise ValueError("❌ Unsupported version delta format (stored by an older version of the version store).")
+    start = len(DELTA_MAGIC)
+    (size,) = struct.unpack(">I", blob[start:start + 4])
+    header = json.loads(blob[start + 4:start + 4 + size])
+    data = blob[start + 4 + size:]
+
+    def frame(name, columns):
+        if name not in header["parts"]:
+            return pd.DataFrame(columns=pd.Index(columns, dtype=object))
+        offset, length = header["parts"][name]
+        return _read_frame(data[offset:offset + length], columns)
+
+    if "replace" in header["parts"]:
+        return {"replace": frame("replace", header["replace_columns"])}
+
+    cell_columns = header["cell_columns"]
+    cells = frame("cells", [f"{k}{j}" for j in range(len(cell_columns)) for k in "vm"])
+    rows, cols, values = [], [], []
+    for j, col in enumerate(cell_columns):
+        mask = cells[f"m{j}"].to_numpy(dtype=bool)
+        rows.append(cells.index[mask])
+        cols.append(np.full(mask.sum(), col, dtype=object))
+        values.append(cells[f"v{j}"].to_numpy(dtype=object)[mask])
+    row_index = rows[0].append(rows[1:]) if rows else cells.index[:0]
+    return {
+        "removed_rows": frame("removed_rows", []).index,
+        "added_rows": frame("added_rows", header["added_rows_columns"]),
+        "cells": (row_index,
+                  np.concatenate(cols) if cols else np.empty(0, dtype=object),
+                  np.concatenate(values) if values else np.empty(0, dtype=object)),
+        "removed_cols": header["removed_cols"],
+        "added_cols": frame("added_cols", header["added_cols"]),
+        "columns": header["columns"],
+        "dtypes": dict(zip(header["columns"], header["dtypes"])),
+        "order": frame("order", []).index if header["has_order"] else None,
+    }
+
+
+# ---------- store ----------
+
+def get_version(version_id):
+    '''
+    Metadata of a version (without the delta), or None.
+    '''
+    with sqlite3.connect(conv_history.DB_PATH) as conn:
+        row = conn.execute("""
+            SELECT version_id, parent_id, base_path, base_hash, sheet_name, delta_size,
+                   cells_changed, rows_added, rows_removed, created
+            FROM scenario_versions WHERE version_id = ?
+        """, (version_id,)).fetchone()
+    if row is None:
+        return None
+    keys = ["version_id", "parent_id", "base_path", "base_hash", "sheet_name", "delta_size",
+            "cells_changed", "rows_added", "rows_removed", "created"]
+    return dict(zip(keys, row))
+
+
+def lineage(version_id):
+    '''
+    Versions from the root edit down to version_id (metadata dicts).
+    '''
+    chain = []
+    while version_id:
+        meta = get_version(version_id)
+        if meta is None:
+            raise ValueError(f"❌ Unknown scenario version: {version_id}")
+        chain.append(meta)
+        version_id = meta["parent_id"]
+    return chain[::-1]
+
+
+def _load_delta(version_id):
+    with sqlite3.connect(conv_history.DB_PATH) as conn:
+        row = conn.execute("SELECT delta FROM scenario_versions WHERE version_id = ?", (version_id,)).fetchone()
+    return decode_delta(row[0])
+
+
+def record_version(df_old, df_new, sheet_name, base_path, parent_id=None):
+    '''
+    Store an edit as a delta against its parent version.
+    Inputs:
+        - df_old (pd.DataFrame): the sheet the edit was applied to
+        - df_new (pd.DataFrame): the edited sheet
+        - sheet_name (str): edited sheet
+        - base_path (str): workbook the lineage starts from (ignored when parent_id is given)
+        - parent_id (str, optional): version the edit was applied to
+    Output: version_id (str)
+    '''
+    if parent_id:
+        parent = get_version(parent_id)
+        base_path, base_hash = parent["base_path"], parent["base_hash"]
+    else:
+        base_hash = file_hash(base_path)
+
+    with span("version_diff"):
+        delta = compute_delta(df_old, df_new)
+        blob = encode_delta(delta)
+    stats = delta_stats(delta)
+
+    version_id = uuid.uuid4().hex[:12]
+    with sqlite3.connect(conv_history.DB_PATH, timeout=10) as conn:
+        conn.execute("""
+            INSERT INTO scenario_versions
+            (version_id, parent_id, base_path, base_hash, sheet_name, delta, delta_size,
+             cells_changed, rows_added, rows_removed, created)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (version_id, parent_id, os.path.abspath(base_path), base_hash, sheet_name, blob, len(blob),
+              stats["cells_changed"], stats["rows_added"], stats["rows_removed"],
+              datetime.now().isoformat(timespec="seconds")))
+
+    _remember((version_id, sheet_name), df_new)
+    print(f"🗂️ Version {version_id}: {stats['cells_changed']} cells changed, +{stats['rows_added']}"
+          f"/-{stats['rows_removed']} rows, delta {len(blob) / 1024:.1f} KB")
+    return version_id
+
+
+def _remember(key, df):
+    with _cache_lock:
+        _materialized[key] = df
+        _materialized.move_to_end(key)
+        while len(_materialized) > MATERIALIZED_CACHE_SIZE:
+            _materialized.popitem(last=False)
+
+
+def load_version_sheet(version_id, sheet_name):
+    '''
+    Materialize one sheet of a version by replaying its lineage's deltas over the base sheet.
+    Starts from the closest cached ancestor. Treat the returned DataFrame as read-only.
+    Inputs:
+        - version_id (str): version to materialize
+        - sheet_name (str): sheet to build
+    Output: pd.DataFrame
+    '''
+    chain = lineage(version_id)
+    with span("version_materialize", depth=len(chain)):
+        start, df = 0, None
+        with _cache_lock:
+            for i in range(len(chain) - 1, -1, -1):
+                cached = _materialized.get((chain[i]["version_id"], sheet_name))
+                if cached is not None:
+                    start, df = i + 1, cached
+                    break
+        if df is None:
+            df = load_sheet(chain[0]["base_path"], sheet_name, chain[0]["base_hash"])
+
+        for meta in chain[start:]:
+            if meta["sheet_name"] == sheet_name:
+                df = apply_delta(df, _load_delta(meta["version_id"]))
+
+    _remember((version_id, sheet_name), df)
+    return df
+
+
+def edited_sheets(version_id):
+    '''
+    Names of the sheets changed anywhere in a version's lineage, in first-edit order.
+    '''
+    sheets = []
+    for meta in lineage(version_id):
+        if meta["sheet_name"] not in sheets:
+            sheets.append(meta["sheet_name"])
+    return sheets
+
+
+def materialize_to_file(version_id, output_file, all_sheets=False):
+    '''
+    Write a version to an .xlsx file.
+    Inputs:
+        - version_id (str): version to write
+        - output_file (str): target path
+        - all_sheets (bool): also copy unedited sheets from the base workbook
+    Output: output_file (str)
+    '''
+    from backend.sheet_cache import sheet_names
+
+    chain = lineage(version_id)
+    edited = edited_sheets(version_id)
+    names = sheet_names(chain[0]["base_path"], chain[0]["base_hash"]) if all_sheets else edited
+    with span("write_output", sheets=len(names)):
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        with pd.ExcelWriter(output_file) as writer:
+            for name in names:
+                if name in edited:
+                    df = load_version_sheet(version_id, name)
+                else:
+                    df = load_sheet(chain[0]["base_path"], name, chain[0]["base_hash"])
+                df.to_excel(writer, sheet_name=name[:31], index=False)
+    return output_file
+
+
+def diff_versions(version_a, version_b, sheet_name):
+    '''
+    Vectorized cell-level diff of one sheet between two versions.
+    Inputs:
+        - version_a (str or None): older version (None = base workbook of version_b)
+        - version_b (str): newer version
+        - sheet_name (str): sheet to compare
+    Output:
+        pd.DataFrame with columns row, column, old, new, change ("modified", "added", "removed")
+    '''
+    df_b = load_version_sheet(version_b, sheet_name)
+    if version_a is None:
+        root = lineage(version_b)[0]
+        df_a = load_sheet(root["base_path"], sheet_name, root["base_hash"])
+    else:
+        df_a = load_version_sheet(version_a, sheet_name)
+
+    if not (df_a.index.is_unique and df_b.index.is_unique):
+        df_a, df_b = df_a.reset_index(drop=True), df_b.reset_index(drop=True)
+    delta = compute_delta(df_a, df_b)
+    rows, cols, values = delta["cells"]
+    old_values = df_a.to_numpy(dtype=object)[df_a.index.get_indexer(rows), df_a.columns.get_indexer(cols)]
+    parts = [pd.DataFrame({"row": rows, "column": cols, "old": old_values, "new": values, "change": "modified"})]
+    def long_form(frame, value_name):
+        # internal names avoid clashes with sheet columns such as "value"
+        melted = frame.astype(object).rename_axis("_row").reset_index() \
+            .melt(id_vars="_row", var_name="_column", value_name="_value")
+        return melted.rename(columns={"_row": "row", "_column": "column", "_value": value_name})
+
+    if len(delta["added_rows"]):
+        parts.append(long_form(delta["added_rows"], "new").assign(old=None, change="added"))
+    if len(delta["added_cols"].columns):
+        parts.append(long_form(delta["added_cols"], "new").assign(old=None, change="added"))
+    if len(delta["removed_rows"]):
+        parts.append(long_form(df_a.loc[delta["removed_rows"]], "old").assign(new=None, change="removed"))
+    return pd.concat(parts, ignore_index=True)[["row", "column", "old", "new", "change"]]
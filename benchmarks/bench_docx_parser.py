@@ -0,0 +1,100 @@
+"""
+Parse-throughput benchmark for the docx chunkers.
+
+Compares the legacy character-based chunker (docx_parse_and_chunk) with the
+structured, token-budgeted chunker (docx_structured_chunks) on every .docx
+file in data/docs, and reports MB/s, chunk counts and chunk sizes.
+
+Usage:
+    python benchmarks/bench_docx_parser.py [--repeat 3] [--max-tokens 256] [--out results.json]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BASE_DIR))
+
+from doc_embedding_service.docx_parser import (  # noqa: E402
+    docx_parse_and_chunk, docx_structured_chunks, estimate_tokens
+)
+
+DOCS_DIR = BASE_DIR / "data" / "docs"
+
+
+def time_call(fn, repeat):
+    '''
+    Run fn `repeat` times and return (median seconds, last result).
+    '''
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def bench_file(path, repeat, max_len, max_tokens):
+    size_mb = path.stat().st_size / 1e6
+
+    legacy_s, legacy = time_call(lambda: docx_parse_and_chunk(str(path), max_len=max_len), repeat)
+    legacy_bodies = ["\n".join(c) for c in legacy]
+
+    structured_s, structured = time_call(lambda: docx_structured_chunks(str(path), max_tokens=max_tokens), repeat)
+    structured_bodies = [c["body"] for c in structured]
+
+    def summary(bodies, seconds):
+        tokens = [estimate_tokens(b) for b in bodies] or [0]
+        return {
+            "seconds": round(seconds, 4),
+            "mb_per_s": round(size_mb / seconds, 2) if seconds else None,
+            "chunks": len(bodies),
+            "total_tokens": sum(tokens),
+            "mean_tokens": round(statistics.mean(tokens), 1),
+            "max_tokens": max(tokens),
+        }
+
+    return {
+        "file": path.name,
+        "size_mb": round(size_mb, 3),
+        "legacy": summary(legacy_bodies, legacy_s),
+        "structured": summary(structured_bodies, structured_s),
+        "chunks_with_table_rows": sum(" | " in b for b in structured_bodies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-len", type=int, default=1000, help="legacy chunker: characters per chunk")
+    parser.add_argument("--max-tokens", type=int, default=256, help="structured chunker: tokens per chunk")
+    parser.add_argument("--out", help="optional path for JSON results")
+    args = parser.parse_args()
+
+    rows = []
+    for path in sorted(DOCS_DIR.glob("*.docx")):
+        if path.name.startswith("~$"):
+            continue
+        row = bench_file(path, args.repeat, args.max_len, args.max_tokens)
+        rows.append(row)
+        print(f"{row['file']:<40} {row['size_mb']:>7.3f} MB | "
+              f"legacy {row['legacy']['mb_per_s']:>7} MB/s {row['legacy']['chunks']:>4} chunks | "
+              f"structured {row['structured']['mb_per_s']:>7} MB/s {row['structured']['chunks']:>4} chunks "
+              f"(max {row['structured']['max_tokens']} tok)")
+
+    total_mb = sum(r["size_mb"] for r in rows)
+    for name in ("legacy", "structured"):
+        seconds = sum(r[name]["seconds"] for r in rows)
+        print(f"⏱️ {name}: {total_mb:.2f} MB in {seconds:.2f}s "
+              f"({total_mb / seconds if seconds else 0:.2f} MB/s), {sum(r[name]['chunks'] for r in rows)} chunks")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(rows, indent=2))
+        print(f"✅ Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
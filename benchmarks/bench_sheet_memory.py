@@ -0,0 +1,121 @@
+"""
+Per-session memory benchmark for sheet loading.
+
+Simulates one editing session per bundled workbook (data/docs and
+data/history/uploads): all sheets are loaded, then a few code-execution attempts
+run on the largest sheet. Two modes are compared:
+    plain - default dtypes (text as Python strings) and a deep copy per attempt
+    typed - backend.sheet_cache typed loading (categoricals, small ints, exact float32)
+            and copy-on-write execution through backend.code_sandbox
+Reports the session's peak traced memory (tracemalloc) and the resident size of
+the loaded sheets. Sheets are parsed into the sheet cache before measuring, so
+only loading and execution are counted.
+
+Usage:
+    python benchmarks/bench_sheet_memory.py [--attempts 4] [--workbooks path ...] [--out results.json]
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BASE_DIR))
+
+import pandas as pd  # noqa: E402
+
+from backend.code_sandbox import enable_copy_on_write, execute_code  # noqa: E402
+from backend.sheet_cache import cache_workbook, file_hash, load_sheet  # noqa: E402
+
+WORKBOOK_DIRS = [BASE_DIR / "data" / "docs", BASE_DIR / "data" / "history" / "uploads"]
+
+# a typical edit: scale part of the value column
+EDIT_CODE = """
+import pandas as pd
+import numpy as np
+if "value" in df.columns:
+    df.loc[df.index[: len(df) // 10], "value"] = df["value"].iloc[: len(df) // 10] * 1.1
+"""
+
+
+def run_session(path, content_hash, names, typed, attempts):
+    '''
+    One editing session. Output: (loaded sheets, largest sheet name)
+    '''
+    sheets = {name: load_sheet(path, name, content_hash, typed=typed) for name in names}
+    target = max(sheets, key=lambda n: sheets[n].size)
+    for _ in range(attempts):
+        if typed:
+            execute_code(EDIT_CODE, sheets[target], "edit")
+        else:
+            with pd.option_context("mode.copy_on_write", False):
+                local_env = {"df": sheets[target].copy()}
+                exec(EDIT_CODE, {}, local_env)
+    return sheets, target
+
+
+def measure(path, content_hash, names, typed, attempts):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    sheets, target = run_session(path, content_hash, names, typed, attempts)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resident = sum(int(df.memory_usage(deep=True).sum()) for df in sheets.values())
+    return {"peak_mb": round(peak / 1e6, 2), "resident_mb": round(resident / 1e6, 2),
+            "seconds": round(seconds, 3), "target": target}
+
+
+def bench_workbook(path, attempts):
+    content_hash = file_hash(path)
+    names = cache_workbook(str(path), content_hash)
+    plain = measure(str(path), content_hash, names, False, attempts)
+    typed = measure(str(path), content_hash, names, True, attempts)
+    return {
+        "file": path.name,
+        "size_mb": round(path.stat().st_size / 1e6, 3),
+        "sheets": len(names),
+        "plain": plain,
+        "typed": typed,
+        "peak_reduction": round(1 - typed["peak_mb"] / plain["peak_mb"], 3) if plain["peak_mb"] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--attempts", type=int, default=4, help="code-execution attempts per session")
+    parser.add_argument("--workbooks", nargs="*", help="workbooks to load (default: bundled .xlsx files)")
+    parser.add_argument("--out", help="optional path for JSON results")
+    args = parser.parse_args()
+    enable_copy_on_write()
+
+    if args.workbooks:
+        paths = [Path(p) for p in args.workbooks]
+    else:
+        paths = sorted(p for d in WORKBOOK_DIRS for p in d.glob("*.xlsx") if not p.name.startswith("~$"))
+
+    rows = []
+    for path in paths:
+        row = bench_workbook(path, args.attempts)
+        rows.append(row)
+        print(f"{row['file']:<60} {row['size_mb']:>6.2f} MB {row['sheets']:>4} sheets | "
+              f"peak {row['plain']['peak_mb']:>8.2f} -> {row['typed']['peak_mb']:>8.2f} MB | "
+              f"resident {row['plain']['resident_mb']:>8.2f} -> {row['typed']['resident_mb']:>8.2f} MB")
+
+    plain = sum(r["plain"]["peak_mb"] for r in rows)
+    typed = sum(r["typed"]["peak_mb"] for r in rows)
+    if plain:
+        print(f"🧠 peak per session, summed over {len(rows)} workbooks: {plain:.1f} MB -> {typed:.1f} MB "
+              f"({(1 - typed / plain) * 100:.0f}% less)")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(rows, indent=2))
+        print(f"✅ Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
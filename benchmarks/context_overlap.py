@@ -0,0 +1,115 @@
+"""
+Context-assembly harness: compares the legacy RAG context (all top-k chunks
+joined) with the token-budgeted, deduplicated context from
+backend.rag_core.context.assemble_context.
+
+For every query it reports context tokens before/after and, unless --no-llm is
+given, generation latency and the word-level F1 overlap between the two answers.
+
+Usage:
+    python benchmarks/context_overlap.py [--queries queries.txt] [--budget 1200] [--no-llm] [--out results.json]
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BASE_DIR))
+
+from backend.config.rag_config import load_rag_resources, RAG_TOP_K  # noqa: E402
+from backend.rag_core.retriever import retrieve_chunks  # noqa: E402
+from backend.rag_core.context import assemble_context, estimate_tokens  # noqa: E402
+
+DEFAULT_QUERIES = [
+    "What is the boundary condition for bound_activity?",
+    "formulas and variables related to fix_cost, inv_cost, var_cost",
+    "what are the technologies in inv_cost sheet?",
+    "which technology is historically the cheapest?",
+    "what does the parameter duration_period_sum measure?",
+    "which index dimensions does resource_cost have?",
+    "what is the technical lifetime of solar_pv_ppl?",
+    "explain the set map_tec_lifetime",
+]
+
+
+def answer_f1(a, b):
+    '''
+    Word-level F1 overlap between two answers (1.0 = same bag of words).
+    '''
+    wa = Counter(re.findall(r"\w+", a.lower()))
+    wb = Counter(re.findall(r"\w+", b.lower()))
+    common = sum((wa & wb).values())
+    if not common:
+        return 0.0
+    precision, recall = common / sum(wa.values()), common / sum(wb.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def timed_answer(query, context, titles):
+    from backend.rag_core.generator import generate_answer
+    start = time.perf_counter()
+    answer = generate_answer(query, context, titles)
+    return answer, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", help="text file with one query per line")
+    parser.add_argument("--budget", type=int, default=1200, help="context token budget")
+    parser.add_argument("--k", type=int, default=RAG_TOP_K)
+    parser.add_argument("--no-llm", action="store_true", help="only compare context sizes")
+    parser.add_argument("--out", help="optional path for JSON results")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        queries = [q.strip() for q in Path(args.queries).read_text().splitlines() if q.strip()]
+
+    model, index, metadata = load_rag_resources()
+    rows = []
+    for query in queries:
+        results = retrieve_chunks(query, model, index, metadata, k=args.k, for_rag=True)
+        legacy_context = "\n\n".join(results["body"])
+        legacy_titles = list(set(results["docTitle"]))
+        context, titles, stats = assemble_context(query, results, max_tokens=args.budget)
+
+        row = {
+            "query": query,
+            "tokens_before": estimate_tokens(legacy_context),
+            "tokens_after": estimate_tokens(context),
+            **stats,
+        }
+        if not args.no_llm:
+            legacy_answer, legacy_s = timed_answer(query, legacy_context, legacy_titles)
+            answer, assembled_s = timed_answer(query, context, titles)
+            row.update({
+                "latency_before_s": round(legacy_s, 3),
+                "latency_after_s": round(assembled_s, 3),
+                "answer_f1": round(answer_f1(legacy_answer, answer), 3),
+                "answer_before": legacy_answer,
+                "answer_after": answer,
+            })
+        rows.append(row)
+        line = f"{row['tokens_before']:>6} → {row['tokens_after']:>6} tokens"
+        if "answer_f1" in row:
+            line += f" | {row['latency_before_s']:.2f}s → {row['latency_after_s']:.2f}s | F1 {row['answer_f1']:.2f}"
+        print(f"{line} | {query}")
+
+    before = sum(r["tokens_before"] for r in rows)
+    after = sum(r["tokens_after"] for r in rows)
+    print(f"📉 Context tokens: {before} → {after} ({100 * (1 - after / before) if before else 0:.1f}% fewer)")
+    if rows and not args.no_llm:
+        print(f"🔁 Mean answer F1 vs. legacy context: {statistics.mean(r['answer_f1'] for r in rows):.3f}")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(rows, indent=2, ensure_ascii=False))
+        print(f"✅ Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
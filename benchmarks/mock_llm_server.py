@@ -0,0 +1,154 @@
+"""
+Local Groq/OpenAI-compatible chat-completions server for offline benchmarks.
+
+Answers POST /openai/v1/chat/completions (the path used by the groq SDK) after a
+configurable latency, with canned responses chosen from the prompt:
+router prompts get a routing JSON, scenario-editor prompts get pandas code
+for the sheet schema in the prompt, SQL prompts get a SELECT over the first
+table, everything else gets a fixed-length answer.
+
+Point the app at it with:
+    GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY1=mock
+
+Usage:
+    python benchmarks/mock_llm_server.py [--port 8765] [--latency-ms 300] [--jitter-ms 50]
+"""
+import argparse
+import ast
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EDIT_WORDS = ("make", "update", "change", "modify", "increase", "decrease", "double", "halve",
+              "reduce", "remove", "drop", "add", "keep", "set", "multiply", "divide")
+
+
+def route_reply(prompt):
+    match = re.search(r"Decide which agent should handle the given input: (.*?)\.\s*\n", prompt, re.S)
+    text = (match.group(1) if match else "").lower()
+    if any(re.search(rf"\b{w}\b", text) for w in EDIT_WORDS) and not text.startswith(("how", "what", "should")):
+        return json.dumps({"selected_agent": "scenario_editor", "reason": "mock: edit keywords"})
+    return json.dumps({"selected_agent": "rag", "reason": "mock: information request"})
+
+
+def code_reply(prompt):
+    match = re.search(r"Schema:\s*(\[.*?\])\s*\n", prompt, re.S)
+    try:
+        columns = ast.literal_eval(match.group(1)) if match else []
+    except (ValueError, SyntaxError):
+        columns = []
+    value_col = "value" if "value" in columns else next((c for c in columns if "value" in str(c).lower()), None)
+    key_col = "technology" if "technology" in columns else (columns[0] if columns else None)
+    year_col = next((c for c in columns if str(c).startswith("year")), None)
+    if value_col is None or key_col is None:
+        return "df = df.copy()"
+    lines = [f"mask = df['{key_col}'].astype(str).str.contains('solar', case=False, na=False)"]
+    if year_col:
+        lines.append(f"mask &= pd.to_numeric(df['{year_col}'], errors='coerce') > 2030")
+    lines.append(f"df.loc[mask, '{value_col}'] = df.loc[mask, '{value_col}'] * 0.9")
+    return "\n".join(lines)
+
+
+def sql_reply(prompt):
+    match = re.search(r'Table "([^"]+)"', prompt)
+    table = match.group(1) if match else "inv_cost"
+    return f'SELECT * FROM "{table}" LIMIT 5'
+
+
+def answer_reply(prompt, words):
+    return "Mock answer. " + " ".join(["lorem"] * words)
+
+
+def make_reply(prompt, answer_words):
+    if "Agent Router" in prompt:
+        return route_reply(prompt)
+    if "DuckDB" in prompt:
+        return sql_reply(prompt)
+    if "data engineer" in prompt:
+        return code_reply(prompt)
+    return answer_reply(prompt, answer_words)
+
+
+def make_handler(latency_ms, jitter_ms, answer_words, stats):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            prompt = "\n".join(m.get("content", "") for m in body.get("messages", []) if isinstance(m, dict))
+
+            delay = max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+            time.sleep(delay)
+            content = make_reply(prompt, answer_words)
+            with stats["lock"]:
+                stats["requests"] += 1
+
+            payload = json.dumps({
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": (len(prompt) + len(content)) // 4,
+                },
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass  # keep benchmark output clean
+
+    return Handler
+
+
+def start_server(port=0, latency_ms=300, jitter_ms=0, answer_words=150):
+    '''
+    Start the mock server on a background thread.
+    Inputs:
+        - port (int): port to bind (0 picks a free port)
+        - latency_ms (float): mean artificial latency per completion
+        - jitter_ms (float): uniform +/- jitter around the mean latency
+        - answer_words (int): length of free-text answers
+    Outputs:
+        - server (ThreadingHTTPServer): call server.shutdown() to stop it
+        - base_url (str): value for GROQ_BASE_URL
+        - stats (dict): request counter shared with the handler
+    '''
+    stats = {"requests": 0, "lock": threading.Lock()}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency_ms, jitter_ms, answer_words, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--answer-words", type=int, default=150)
+    args = parser.parse_args()
+
+    server, base_url, _ = start_server(args.port, args.latency_ms, args.jitter_ms, args.answer_words)
+    print(f"🧪 Mock LLM server listening on {base_url} (latency {args.latency_ms} ms)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
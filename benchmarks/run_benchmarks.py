@@ -0,0 +1,188 @@
+"""
+Offline end-to-end benchmark for orchestrate.
+
+Replays a query corpus (seeded from data/history/conv_history.db) through
+orchestrate against the local mock LLM server, on each benchmark workbook,
+and reports throughput plus per-stage latency from the request traces
+(routing, encode/faiss retrieval, sheet loading, code execution, output
+writing, ...). Results are written as JSON; pass --baseline to compare
+against an earlier run and flag regressions.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--latency-ms 300] [--concurrency 1] [--limit 40]
+        [--workbooks data/history/uploads/solar-scenario.xlsx data/docs/MESSAGEix-Pakistan-CurPol.xlsx]
+        [--baseline benchmarks/results/bench-....json] [--fail-threshold 0.2]
+
+Run from the repository root (the app resolves its data paths relative to it).
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BASE_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mock_llm_server import start_server  # noqa: E402
+
+CORPUS_DB = BASE_DIR / "data" / "history" / "conv_history.db"
+RESULTS_DIR = BASE_DIR / "benchmarks" / "results"
+DEFAULT_WORKBOOKS = [
+    "data/history/uploads/solar-scenario.xlsx",
+    "data/docs/MESSAGEix-Pakistan-CurPol.xlsx",
+]
+
+
+def load_corpus(db_path, limit=None):
+    '''
+    Distinct queries from the conversation history, in first-seen order.
+    Output: list of (query, recorded mode) tuples
+    '''
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT query, mode FROM conversation_history ORDER BY turn_id").fetchall()
+    seen, corpus = set(), []
+    for query, mode in rows:
+        query = query.strip()
+        if query and query.lower() not in seen:
+            seen.add(query.lower())
+            corpus.append((query, mode))
+    return corpus[:limit] if limit else corpus
+
+
+def run_one(orchestrate, query, workbook, keep_outputs):
+    start = time.perf_counter()
+    record = {"query": query, "workbook": os.path.basename(workbook)}
+    try:
+        result = orchestrate(instruction=query, input_file=workbook)
+        record.update({"mode": result["mode"], "ok": True, "trace": result.get("trace", [])})
+        output_file = result.get("output_file")
+        if result.get("version_id"):
+            # edits are stored as deltas; time building the downloadable workbook separately
+            from backend.version_store import materialize_to_file
+            write_start = time.perf_counter()
+            materialize_to_file(result["version_id"], output_file)
+            record["trace"].append({"stage": "write_output", "tokens_in": None, "tokens_out": None,
+                                    "duration_ms": (time.perf_counter() - write_start) * 1000})
+        if output_file and not keep_outputs and os.path.exists(output_file):
+            os.remove(output_file)
+    except Exception as e:
+        record.update({"ok": False, "error": f"{type(e).__name__}: {e}", "trace": []})
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def summarize_runs(records):
+    from backend.tracing import summarize
+    rows = [(s["stage"], s["duration_ms"], s["tokens_in"], s["tokens_out"])
+            for r in records for s in r["trace"]]
+    return {s["stage"]: s for s in summarize(rows)}
+
+
+def compare(current, baseline, threshold):
+    '''
+    Print p50 changes per stage and return the stages that regressed by more than `threshold`.
+    '''
+    regressions = []
+    for workbook, result in current["workbooks"].items():
+        base = baseline.get("workbooks", {}).get(workbook)
+        if not base:
+            continue
+        print(f"\n📊 {workbook} vs. baseline")
+        for stage, s in result["stages"].items():
+            b = base["stages"].get(stage)
+            if not b or not b["p50_ms"]:
+                continue
+            change = s["p50_ms"] / b["p50_ms"] - 1
+            flag = "⚠️" if change > threshold else "  "
+            print(f"{flag} {stage:<22} p50 {b['p50_ms']:>9.1f} → {s['p50_ms']:>9.1f} ms ({change:+.1%})")
+            if change > threshold:
+                regressions.append(f"{workbook}:{stage}")
+        tp_change = result["throughput_rps"] / base["throughput_rps"] - 1 if base["throughput_rps"] else 0
+        print(f"   throughput {base['throughput_rps']:.2f} → {result['throughput_rps']:.2f} req/s ({tp_change:+.1%})")
+        if tp_change < -threshold:
+            regressions.append(f"{workbook}:throughput")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=300, help="mock LLM latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--limit", type=int, help="use only the first N corpus queries")
+    parser.add_argument("--workbooks", nargs="+", default=DEFAULT_WORKBOOKS)
+    parser.add_argument("--corpus-db", default=str(CORPUS_DB))
+    parser.add_argument("--keep-outputs", action="store_true", help="keep the updated workbooks")
+    parser.add_argument("--out", help="results path (default: benchmarks/results/bench-<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--fail-threshold", type=float, default=0.2, help="relative p50 slowdown counted as regression")
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)
+    server, base_url, llm_stats = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ["GROQ_API_KEY1"] = "mock"
+
+    # keep benchmark turns and traces out of the real history database
+    from backend import conv_history
+    conv_history.DB_PATH = Path(tempfile.mkdtemp(prefix="peach-bench-")) / "conv_history.db"
+    from backend.orchestrator_agent import orchestrate
+
+    corpus = load_corpus(args.corpus_db, args.limit)
+    print(f"🧪 {len(corpus)} queries × {len(args.workbooks)} workbooks, mock LLM at {base_url} "
+          f"({args.latency_ms} ms), concurrency {args.concurrency}")
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "out")},
+        "workbooks": {},
+    }
+    for workbook in args.workbooks:
+        requests_before = llm_stats["requests"]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            records = list(pool.map(lambda q: run_one(orchestrate, q[0], workbook, args.keep_outputs), corpus))
+        wall = time.perf_counter() - start
+
+        latencies = [r["seconds"] for r in records if r["ok"]]
+        name = os.path.basename(workbook)
+        results["workbooks"][name] = {
+            "requests": len(records),
+            "failures": sum(not r["ok"] for r in records),
+            "llm_calls": llm_stats["requests"] - requests_before,
+            "wall_seconds": round(wall, 3),
+            "throughput_rps": len(records) / wall if wall else 0,
+            "latency_p50_s": statistics.median(latencies) if latencies else None,
+            "stages": summarize_runs(records),
+            "errors": sorted({r["error"] for r in records if not r["ok"]}),
+        }
+        r = results["workbooks"][name]
+        print(f"\n📘 {name}: {r['requests']} requests in {wall:.1f}s ({r['throughput_rps']:.2f} req/s), "
+              f"{r['failures']} failures, {r['llm_calls']} LLM calls")
+        for stage, s in r["stages"].items():
+            print(f"   {stage:<22} n={s['count']:<4} p50 {s['p50_ms']:>9.1f} ms  p95 {s['p95_ms']:>9.1f} ms")
+
+    server.shutdown()
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.write_text(json.dumps(results, indent=2))
+    print(f"\n✅ Results written to {out}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.fail_threshold)
+        if regressions:
+            print(f"\n❌ Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from docx import Document as DocReader
 from pathlib import Path
 import re
+import hashlib
+
+from backend.rag_core.tokens import estimate_tokens
 
 def read_docx_file(path):
     '''
@@ -128,4 +131,318 @@ def docx_parse_and_chunk(input_file_path, max_len):
     chunked_text = split_headings(raw_text)
     sections = split_into_sections(chunked_text)
     chunks = split_section_into_chunks(file_name, sections, max_len)
-    return chunks
\ No newline at end of file
+    return chunks
+
+
+# ---------------------------------------------------------------------------
+# Structured chunker: Word heading styles, Word tables, and the RST markup
+# (underlined titles, `.. _label:` anchors, `.. list-table::`) that the GAMS
+# documentation files carry inside their `*` comment lines.
+# ---------------------------------------------------------------------------
+
+RST_UNDERLINE = re.compile(r"^([=\-~^\"'`#+])\1{2,}$")
+RST_ANCHOR = re.compile(r"^\.\. _([^:]+):\s*$")
+LIST_TABLE_ROW = re.compile(r"^\*\s+-\s?(.*)$")
+LIST_TABLE_CELL = re.compile(r"^-\s?(.*)$")
+
+
+def iter_docx_blocks(path):
+    '''
+    Walk a .docx body in document order.
+    Input: path to a .docx file
+    Output: generator of ("paragraph", text, heading_level) and ("table", rows) tuples,
+            where heading_level is the Word heading level (0 for body text)
+            and rows is a list of lists of cell texts
+    '''
+    from docx.oxml.ns import qn
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    if not path.lower().endswith(".docx"):
+        raise ValueError(f"Unsupported file type: {path}")
+
+    src = DocReader(path)
+    heading_levels = {}     # style id -> heading level; resolving a style by id is a scan of styles.xml
+    for child in src.element.body.iterchildren():
+        if child.tag == qn("w:p"):
+            paragraph = Paragraph(child, src)
+            style_id = child.style
+            if style_id not in heading_levels:
+                style_name = paragraph.style.name if paragraph.style is not None else ""
+                match = re.match(r"^(Heading|Title)\s*(\d*)", style_name or "")
+                heading_levels[style_id] = (int(match.group(2)) if match.group(2) else 1) if match else 0
+            yield ("paragraph", paragraph.text, heading_levels[style_id])
+        elif child.tag == qn("w:tbl"):
+            rows = []
+            for row in Table(child, src).rows:
+                cells = []
+                for cell in row.cells:
+                    text = " ".join(cell.text.split())
+                    # merged cells are repeated by python-docx, keep one copy
+                    if not cells or cells[-1] != text:
+                        cells.append(text)
+                rows.append(cells)
+            yield ("table", rows)
+
+
+def strip_comment_marker(line):
+    '''
+    Remove the GAMS comment marker ("* ") from a line, keeping the indentation
+    after it so RST structures (list-tables, definition bodies) can still be read.
+    '''
+    if line.startswith("* "):
+        return line[2:].rstrip()
+    if line.strip() == "*":
+        return ""
+    return line.rstrip()
+
+
+def format_table_row(header, row):
+    '''
+    Render a table row as "column: value | column: value" so each row
+    is self-describing inside a chunk. Empty cells are skipped.
+    '''
+    if not header:
+        return " | ".join(cell for cell in row if cell)
+    pairs = []
+    for i, cell in enumerate(row):
+        if not cell:
+            continue
+        name = header[i] if i < len(header) else f"col{i + 1}"
+        pairs.append(f"{name}: {cell}")
+    return " | ".join(pairs)
+
+
+def parse_list_table(lines, start, indent):
+    '''
+    Parse an RST `.. list-table::` starting after the directive line.
+    Inputs:
+        - lines (list): comment-stripped lines of the document
+        - start (int): index of the first line after the directive
+        - indent (int): indentation of the directive line
+    Outputs:
+        - rows (list): list of lists of cell texts (header row first when present)
+        - header_rows (int): value of the :header-rows: option (0 if missing)
+        - end (int): index of the first line after the table
+    '''
+    rows, header_rows = [], 0
+    i = start
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        line_indent = len(line) - len(line.lstrip())
+        if stripped and line_indent <= indent:
+            break
+        if stripped.startswith(":header-rows:"):
+            header_rows = int(stripped.split(":")[-1].strip() or 0)
+        elif stripped.startswith(":"):
+            pass  # other directive options (:widths:, :class:, ...)
+        elif LIST_TABLE_ROW.match(stripped):
+            rows.append([LIST_TABLE_ROW.match(stripped).group(1)])
+        elif LIST_TABLE_CELL.match(stripped) and rows:
+            rows[-1].append(LIST_TABLE_CELL.match(stripped).group(1))
+        elif stripped and rows:
+            rows[-1][-1] = f"{rows[-1][-1]} {stripped.lstrip('| ')}".strip()
+        i += 1
+
+    # clean leading line-block markers ("| ") and whitespace inside cells
+    rows = [[" ".join(cell.split()).lstrip("| ") for cell in row] for row in rows]
+    return rows, header_rows, i
+
+
+def extract_sections(blocks):
+    '''
+    Group docx blocks into sections keyed by their heading path.
+    Input:
+        blocks (iterable): output of iter_docx_blocks
+    Output:
+        sections (list): list of dicts with keys
+            - heading (str): heading path, e.g. "Parameter definition > Parameters of the `Demand` section"
+            - refs (list): RST anchor labels attached to the section
+            - items (list): ("text", line) and ("row", line) entries in document order
+    '''
+    # flatten paragraphs into lines, keeping Word headings and tables as markers
+    lines, markers = [], {}
+    for block in blocks:
+        if block[0] == "table":
+            markers[len(lines)] = ("table", block[1])
+            lines.append("")
+        else:
+            _, text, level = block
+            for raw in text.splitlines() or [""]:
+                if level:
+                    markers[len(lines)] = ("heading", level)
+                lines.append(strip_comment_marker(raw))
+
+    sections = []
+    heading_stack = []          # list of (level, title)
+    underline_levels = []       # RST underline characters, in order of first use
+    pending_refs = []
+
+    def start_section(title, level, refs):
+        while heading_stack and heading_stack[-1][0] >= level:
+            heading_stack.pop()
+        heading_stack.append((level, title))
+        sections.append({
+            "heading": " > ".join(t for _, t in heading_stack),
+            "refs": list(refs),
+            "items": [],
+        })
+
+    def current_items():
+        if not sections:
+            sections.append({"heading": "", "refs": [], "items": []})
+        return sections[-1]["items"]
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        marker = markers.get(i)
+
+        # --- Word tables ---
+        if marker and marker[0] == "table":
+            rows = [r for r in marker[1] if any(r)]
+            # first row is the header unless the table has a single row
+            header, body = (rows[0], rows[1:]) if len(rows) > 1 else ([], rows)
+            for row in body:
+                current_items().append(("row", format_table_row(header, row)))
+            i += 1
+            continue
+
+        # --- Word heading styles ---
+        if marker and marker[0] == "heading" and stripped:
+            start_section(stripped, marker[1], pending_refs)
+            pending_refs = []
+            i += 1
+            continue
+
+        # --- RST anchors ---
+        anchor = RST_ANCHOR.match(stripped)
+        if anchor:
+            pending_refs.append(anchor.group(1))
+            i += 1
+            continue
+
+        # --- RST underlined titles ---
+        next_line = lines[i + 1].strip() if i + 1 < len(lines) else ""
+        if stripped and RST_UNDERLINE.match(next_line) and len(next_line) >= len(stripped) - 2 \
+                and not RST_UNDERLINE.match(stripped):
+            char = next_line[0]
+            if char not in underline_levels:
+                underline_levels.append(char)
+            # Word heading levels come first; RST levels nest below the deepest Word level in use
+            start_section(stripped, 10 + underline_levels.index(char), pending_refs)
+            pending_refs = []
+            i += 2
+            continue
+
+        # --- RST list-tables ---
+        if stripped.startswith(".. list-table::"):
+            indent = len(line) - len(line.lstrip())
+            title = stripped[len(".. list-table::"):].strip()
+            rows, header_rows, i = parse_list_table(lines, i + 1, indent)
+            header = rows[0] if header_rows and rows else []
+            body = rows[header_rows:] if header_rows else rows
+            items = current_items()
+            if title:
+                items.append(("text", f"Table: {title}"))
+            for row in body:
+                items.append(("row", format_table_row(header, row)))
+            continue
+
+        if not stripped or is_divider(stripped):
+            i += 1
+            continue
+
+        # anchors followed by body text (e.g. a parameter definition) open a sub-section
+        if pending_refs:
+            parent_level = heading_stack[-1][0] if heading_stack else 0
+            start_section(", ".join(pending_refs), parent_level + 1, pending_refs)
+            pending_refs = []
+
+        current_items().append(("text", stripped))
+        i += 1
+
+    return [s for s in sections if s["items"]]
+
+
+def split_long_text(text, max_tokens):
+    '''
+    Split a single line that exceeds the token budget at word boundaries.
+    '''
+    parts, current = [], []
+    for word in text.split():
+        if current and estimate_tokens(" ".join(current + [word])) > max_tokens:
+            parts.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+
+def make_chunk_id(stem, heading, body, seen):
+    '''
+    Build a chunk ID from the document stem and a hash of the chunk content.
+    IDs stay the same across re-parses as long as the chunk content does not change,
+    and do not shift when chunks are added or removed elsewhere in the document.
+    '''
+    digest = hashlib.sha1(f"{heading}\n{body}".encode("utf-8")).hexdigest()[:12]
+    chunk_id = f"{stem}_{digest}"
+    if chunk_id in seen:
+        seen[chunk_id] += 1
+        chunk_id = f"{chunk_id}-{seen[chunk_id]}"
+    else:
+        seen[chunk_id] = 0
+    return chunk_id
+
+
+def docx_structured_chunks(input_file_path, max_tokens=256):
+    '''
+    Reads a .docx file and returns token-budgeted, structure-aware chunks for RAG.
+
+    Sections follow Word heading styles and RST titles/anchors; Word tables and
+    RST list-tables are kept as one "column: value | ..." line per row, so a chunk
+    never cuts a table row in half. Every chunk starts with its heading path.
+
+    Inputs:
+        - input_file_path (str): path to the .docx file
+        - max_tokens (int): approximate token budget per chunk (see estimate_tokens)
+    Output:
+        chunks (list): list of dicts with keys chunkId, heading, body
+    '''
+    path = Path(input_file_path)
+    sections = extract_sections(iter_docx_blocks(str(path)))
+
+    chunks, seen = [], {}
+    for section in sections:
+        heading = section["heading"] or path.name
+        prefix = [f"heading: {heading}"]
+        if section["refs"]:
+            prefix.append(f"refs: {', '.join(section['refs'])}")
+        prefix_tokens = estimate_tokens("\n".join(prefix))
+        budget = max(max_tokens - prefix_tokens, 32)
+
+        lines = []
+        for _, text in section["items"]:
+            if estimate_tokens(text) > budget:
+                lines.extend(split_long_text(text, budget))
+            else:
+                lines.append(text)
+
+        current, current_tokens = [], 0
+        for line in lines:
+            line_tokens = estimate_tokens(line)
+            if current and current_tokens + line_tokens > budget:
+                body = "\n".join(prefix + current)
+                chunks.append({"chunkId": make_chunk_id(path.stem, heading, body, seen), "heading": heading, "body": body})
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+
+        if current:
+            body = "\n".join(prefix + current)
+            chunks.append({"chunkId": make_chunk_id(path.stem, heading, body, seen), "heading": heading, "body": body})
+
+    return chunks
@@ -1,12 +1,14 @@
 import faiss, pandas as pd, numpy as np
+import sys
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 from sentence_transformers import SentenceTransformer
 from itertools import chain
-# from doc_embedding_service.docx_parser import docx_parse_and_chunk
+# from doc_embedding_service.docx_parser import docx_structured_chunks
 # from doc_embedding_service.xlsx_parser import excel_parse
 
-from docx_parser import docx_parse_and_chunk
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))   # repo root, for backend.rag_core.tokens
+from docx_parser import docx_structured_chunks
 from xlsx_parser import excel_parse
 
 # --- paths ---
@@ -24,7 +26,7 @@ META_PATH  = RAG_STORE_DIR / "rag_metadata.parquet"
 
 # --- configurations ---
 EMBEDDING_MODEL = "intfloat/e5-small-v2"      
-MAX_LEN_DOCX, MAX_LEN_XLSX = 1000, 2000
+MAX_TOKENS_DOCX, MAX_LEN_XLSX = 256, 2000      # docx: token budget, xlsx: characters
 PKT = timezone(timedelta(hours=5))
 
 def add_to_index():
@@ -36,7 +38,7 @@ def add_to_index():
         index = faiss.read_index(str(INDEX_PATH))
         print(f"✅ Loaded existing index with {len(metadata)} records")
     else:
-        metadata = pd.DataFrame(columns=["chunkId", "docTitle", "insertionDate", "body"])
+        metadata = pd.DataFrame(columns=["chunkId", "docTitle", "docType", "sheetName", "insertionDate", "body"])
         index = None
         print("🆕 No existing index found — creating new one")
 
@@ -52,16 +54,22 @@ def add_to_index():
             continue  # already indexed
 
         if path.suffix.lower() ==".docx":
-            chunks = docx_parse_and_chunk(str(path), max_len=MAX_LEN_DOCX)
+            # structured chunks carry stable, content-derived chunk IDs
+            chunks = docx_structured_chunks(str(path), max_tokens=MAX_TOKENS_DOCX)
         else:
-            chunks = excel_parse(str(path), max_len=MAX_LEN_XLSX)
+            chunks = [{"chunkId": f"{path.stem}_{i:04d}", "body": text}
+                      for i, text in enumerate(excel_parse(str(path), max_len=MAX_LEN_XLSX))]
 
+        # docType / sheetName let the retriever restrict searches to documents or sheets
         new_records = [{
-            "chunkId": f"{path.stem}_{i:04d}",
+            "chunkId": chunk["chunkId"],
             "docTitle": path.name,
+            "docType": path.suffix.lower().lstrip("."),
+            "sheetName": chunk["body"].split("\n", 1)[0].replace("Sheet: ", "").strip()
+                         if path.suffix.lower() == ".xlsx" else None,
             "insertionDate": datetime.now(PKT).isoformat(),
-            "body": text
-        } for i, text in enumerate(chunks)]
+            "body": chunk["body"]
+        } for chunk in chunks]
 
         new_embs = model.encode([r["body"] for r in new_records], convert_to_numpy=True)
         faiss.normalize_L2(new_embs)
@@ -0,0 +1,76 @@
+"""
+Retrieval scores and context assembly must agree on what "most relevant" means:
+the chunk closest to the query ranks first and survives the token budget.
+"""
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from backend.rag_core.context import assemble_context  # noqa: E402
+
+DIM = 32
+CHUNKS = 5
+WORDS_PER_CHUNK = 250     # 5 chunks of ~250 tokens against a 1200-token budget: one is dropped
+
+
+class FixedModel:
+    '''Stands in for the sentence-transformer: always returns the same query embedding.'''
+
+    def __init__(self, embedding):
+        self.embedding = embedding
+
+    def encode(self, texts, **kwargs):
+        return self.embedding.copy()
+
+
+@pytest.fixture
+def retriever(tmp_path, monkeypatch):
+    # retriever.py creates rag_store under its fixed BASE_DIR on import
+    (tmp_path / r"D:\lums-python-programming\thesis\project").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("backend.rag_core.retriever")
+
+
+@pytest.fixture
+def store():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(CHUNKS, DIM)).astype("float32")
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexHNSWFlat(DIM, 32)        # L2 metric, as built by index_manager
+    index.add(vectors)
+    metadata = pd.DataFrame({
+        "docTitle": ["a.docx", "a.docx", "b.docx", "b.docx", "c.docx"],
+        "body": [" ".join([f"chunk{i}"] * WORDS_PER_CHUNK) for i in range(CHUNKS)],
+    })
+    return vectors, index, metadata
+
+
+def test_closest_chunk_ranks_first(retriever, store):
+    vectors, index, metadata = store
+    results = retriever.retrieve_chunks("q", FixedModel(vectors[3:4]), index, metadata, k=CHUNKS, for_rag=True)
+    assert results["body"].iloc[0].startswith("chunk3")
+    assert results["similarity"].iloc[0] == pytest.approx(1.0, abs=1e-5)
+    assert results["similarity"].is_monotonic_decreasing
+
+
+def test_closest_chunk_survives_budget(retriever, store):
+    vectors, index, metadata = store
+    results = retriever.retrieve_chunks("q", FixedModel(vectors[3:4]), index, metadata, k=CHUNKS, for_rag=True)
+    context, titles, stats = assemble_context("q", results, max_tokens=1200)
+    assert stats["chunks_out"] < CHUNKS
+    assert "chunk3" in context
+    assert titles[0] == "b.docx"
+
+
+def test_filtered_scores_match_unfiltered(retriever, store):
+    vectors, index, metadata = store
+    model = FixedModel(vectors[3:4])
+    unfiltered = retriever.retrieve_chunks("q", model, index, metadata, k=CHUNKS, for_rag=True)
+    filtered = retriever.retrieve_chunks("q", model, index, metadata, k=CHUNKS, for_rag=True, doc_title="b.docx")
+    expected = unfiltered.set_index("body")["similarity"]
+    for body, similarity in zip(filtered["body"], filtered["similarity"]):
+        assert similarity == pytest.approx(expected[body], abs=1e-5)